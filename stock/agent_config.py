@@ -24,9 +24,15 @@ SYSTEM_PROMPT = """
 可用工具：
 - get_stock_code_by_name：根据股票名称查询股票代码
 - analyze_stock_trend_detailed：对单只股票进行详细趋势分析
+- analyze_intraday：分时走势分析（1/5/15分钟K线的VWAP、日内振幅、成交量异动），盘中判断止损/止盈时使用
 - buy_stock：根据股票代码和手数买入股票，更新持仓，下单时请指定止损和止盈条件
 - sell_stock：根据股票代码和手数卖出股票，更新持仓
 - get_portfolio：查询当前账户的现金余额和持仓情况
+- portfolio_risk：组合风险分析（收益、最大回撤、波动率、持仓贡献、相关性、权益曲线），回答风险类问题时使用
+- add_to_watchlist：把股票加入自选股监控，可设置价格提醒
+- poll_watchlist_events：轮询自选股异动事件（涨跌幅、量比、换手率、价格阈值穿越），无需重新下载行情
+- rank_stocks：全市场横截面排名（区间涨幅、相对大盘强弱、波动率），可按市值过滤，回答“最强/最弱的股票”类问题时使用
+- analyze_sectors：行业/概念板块强弱排行（市值加权涨跌幅、上涨占比、成交额、领涨股），回答板块类问题时优先使用
 
 使用原则：
 - 在给出“买入”或“卖出”决策前，可以先调用分析类工具获取必要信息
@@ -69,11 +75,21 @@ class ResponseFormat:
 
 from langchain.agents.structured_output import ToolStrategy
 from stock.stock_tools import stock_tools
-
-agent = create_agent(
-    model=model,
-    system_prompt=SYSTEM_PROMPT,
-    tools=stock_tools,
-    checkpointer=checkpointer,
-    response_format=ToolStrategy(ResponseFormat)
-)
+from stock.watchlist import watchlist_tools
+from stock.sector_tools import sector_tools
+from stock.price_matrix import matrix_tools
+from stock.portfolio_risk import risk_tools
+from stock.intraday import intraday_tools
+
+def build_agent(model, checkpointer=None):
+    """用指定模型构建Agent，工具和响应格式与线上一致（压测时传入桩模型）"""
+    return create_agent(
+        model=model,
+        system_prompt=SYSTEM_PROMPT,
+        tools=stock_tools + watchlist_tools + sector_tools + matrix_tools + risk_tools + intraday_tools,
+        checkpointer=checkpointer,
+        response_format=ToolStrategy(ResponseFormat)
+    )
+
+
+agent = build_agent(model, checkpointer)
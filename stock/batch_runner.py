@@ -0,0 +1,176 @@
+"""
+批量运行模式 - 无界面地并行驱动多个模拟账户的Agent会话
+
+输入文件每行一个任务，可以是纯文本提示词，也可以是JSON对象：
+    {"user_id": "acc_001", "prompt": "分析一下我的持仓"}
+    {"user_id": "acc_002", "watchlist": ["000001", "600519"]}
+
+不同账户之间并行；同一 user_id 的多行按文件顺序串行执行（同一账户、同一会话线程不会并发交易）。
+user_id 只能包含字母、数字、下划线和连字符。
+
+运行:
+    uv run python -m stock.batch_runner prompts.jsonl -o results.jsonl -w 8
+"""
+import argparse
+import json
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+
+# 交易类工具，结果会单独汇总到 trades 字段
+TRADE_TOOLS = {'buy_stock', 'sell_stock'}
+
+USER_ID_PATTERN = re.compile(r"[\w-]+")
+
+WATCHLIST_PROMPT = "请逐一分析以下自选股的走势，并根据你的交易系统决定是否买入、卖出或持有：{codes}"
+
+
+def load_jobs(path):
+    '''读取任务文件，返回任务字典列表'''
+    jobs = []
+    thread_owners = {}  # thread_id -> user_id
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                job = json.loads(line)
+            else:
+                job = {"prompt": line}
+
+            user_id = str(job.get("user_id") or f"batch_{line_no}")
+            if not USER_ID_PATTERN.fullmatch(user_id):
+                raise ValueError(f"第{line_no}行 user_id 只能包含字母、数字、下划线和连字符: {user_id!r}")
+            thread_id = str(job.get("thread_id") or user_id)
+            owner = thread_owners.setdefault(thread_id, user_id)
+            if owner != user_id:
+                raise ValueError(f"第{line_no}行 thread_id {thread_id!r} 已被 user_id {owner!r} 使用")
+            prompt = job.get("prompt")
+            if not prompt and job.get("watchlist"):
+                prompt = WATCHLIST_PROMPT.format(codes="、".join(job["watchlist"]))
+            if not prompt:
+                raise ValueError(f"第{line_no}行缺少 prompt 或 watchlist")
+
+            jobs.append({
+                "user_id": user_id,
+                "thread_id": thread_id,
+                "prompt": prompt,
+            })
+    return jobs
+
+
+def _parse_tool_content(content):
+    if isinstance(content, str):
+        try:
+            return json.loads(content)
+        except Exception:
+            return content
+    return content
+
+
+def run_job(job, recursion_limit=50):
+    '''在独立的 thread_id 和 Context.user_id 下运行一次Agent，返回结果字典'''
+    # 延迟导入：进程池中每个子进程各自初始化Agent
+    from stock.agent_config import agent
+    from stock.stock_tools import Context
+    from stock.records import Trade
+
+    config = {"configurable": {"thread_id": job["thread_id"]}, "recursion_limit": recursion_limit}
+    record = {
+        "user_id": job["user_id"],
+        "thread_id": job["thread_id"],
+        "prompt": job["prompt"],
+        "started_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "response": None,
+        "trading_decision": None,
+        "risk_warning": None,
+        "trades": [],
+        "error": None,
+    }
+    start = time.perf_counter()
+    try:
+        # 同一账户的多行任务共用会话线程，只统计本次运行新增的消息中的交易
+        prior = len(agent.get_state(config).values.get("messages", []))
+        result = agent.invoke(
+            {"messages": [{"role": "user", "content": job["prompt"]}]},
+            config=config,
+            context=Context(user_id=job["user_id"]),
+        )
+
+        structured = result.get("structured_response")
+        if structured is not None:
+            record["response"] = getattr(structured, 'response', None)
+            record["trading_decision"] = getattr(structured, 'trading_decision', None)
+            record["risk_warning"] = getattr(structured, 'risk_warning', None)
+
+        for msg in result.get("messages", [])[prior:]:
+            if getattr(msg, 'type', None) == 'tool' and getattr(msg, 'name', None) in TRADE_TOOLS:
+                trade = Trade.from_tool_result(_parse_tool_content(getattr(msg, 'content', '')))
+                if trade is not None:
+                    record["trades"].append(trade.to_dict())
+    except Exception as e:
+        record["error"] = str(e)
+
+    record["elapsed_sec"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def run_account(jobs, recursion_limit=50):
+    '''按顺序串行运行同一账户的全部任务'''
+    return [run_job(job, recursion_limit) for job in jobs]
+
+
+def run_batch(jobs, output_path, workers=4, use_processes=False, recursion_limit=50):
+    '''按账户并行运行全部任务，每个账户完成后追加写入其结果（每个任务一行JSON），返回成功/失败计数'''
+    executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    ok, failed = 0, 0
+
+    accounts = {}
+    for job in jobs:
+        accounts.setdefault(job["user_id"], []).append(job)
+
+    with open(output_path, "a", encoding="utf-8") as out, executor_cls(max_workers=workers) as pool:
+        futures = [pool.submit(run_account, account_jobs, recursion_limit) for account_jobs in accounts.values()]
+        for future in as_completed(futures):
+            for record in future.result():
+                out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                out.flush()
+                if record["error"]:
+                    failed += 1
+                    print(f"❌ [{record['user_id']}] {record['error']}", flush=True)
+                else:
+                    ok += 1
+                    print(f"✅ [{record['user_id']}] {record['elapsed_sec']}s, 交易 {len(record['trades'])} 笔", flush=True)
+
+    return ok, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量运行股票Agent会话")
+    parser.add_argument("input", help="任务文件，每行一个提示词或JSON对象")
+    parser.add_argument("-o", "--output", default="data/batch_results.jsonl", help="结果输出文件（JSON lines，追加写入）")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="并行数")
+    parser.add_argument("--processes", action="store_true", help="使用进程池代替线程池")
+    parser.add_argument("--recursion-limit", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs(args.input)
+    print(f"🚀 共 {len(jobs)} 个任务（{len({job['user_id'] for job in jobs})} 个账户），并行数 {args.workers}", flush=True)
+    start = time.perf_counter()
+    ok, failed = run_batch(
+        jobs,
+        args.output,
+        workers=args.workers,
+        use_processes=args.processes,
+        recursion_limit=args.recursion_limit,
+    )
+    print(f"🏁 完成: 成功 {ok}，失败 {failed}，耗时 {time.perf_counter() - start:.1f}s，结果写入 {args.output}")
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,19 +3,79 @@ Gradio Web界面 - 股票分析AI助手
 支持流式输出和工具调用可视化
 """
 import gradio as gr
-from stock.agent_config import agent
+from stock.agent_config import ResponseFormat, agent
 from stock.stock_tools import Context
+from stock.watchlist import watchlist_monitor, format_events_markdown
+from stock.portfolio_risk import start_equity_recorder
+from stock.intent_router import record_exchange, route_message, router_stats
+from stock.prefetch import start_prefetch
+from stock.scheduler import start_scheduler
 import json
+import os
+import queue
+import threading
+import time
 
 
 config = {"configurable": {"thread_id": "1"}, "recursion_limit": 50}
 context = Context(user_id="1")
 
 
-# Removed unused helper functions for formatting tool calls/results to simplify the file
+# 界面刷新帧率上限（每秒最多推送几次），流式回复会在两次推送之间合并
+UI_MAX_FPS = float(os.getenv("UI_MAX_FPS", "8"))
+# 较早的历史消息超过该长度时，发给页面的副本只保留前面部分（完整内容保存在服务端会话状态中）
+HISTORY_MSG_MAX_CHARS = int(os.getenv("HISTORY_MSG_MAX_CHARS", "4000"))
+# 最近几条历史消息完整显示
+HISTORY_KEEP_RECENT = 4
+TRUNCATED_NOTE = "…（内容过长，仅显示前 {shown} 字，共 {total} 字）"
 
+_STREAM_DONE = object()
 
-def chat_with_agent(message, history, tool_log):
+
+def _display_history(history):
+    """生成发给页面的历史副本：较早的超长消息截断显示，原历史不修改"""
+    display = []
+    cutoff = len(history) - HISTORY_KEEP_RECENT
+    for i, msg in enumerate(history):
+        content = msg.get("content") if isinstance(msg, dict) else None
+        if i >= cutoff or not isinstance(content, str) or len(content) <= HISTORY_MSG_MAX_CHARS:
+            display.append(msg)
+            continue
+        # 尽量在换行处切开，避免把表格或代码块切成两半
+        cut = content.rfind("\n", 0, HISTORY_MSG_MAX_CHARS)
+        if cut <= 0:
+            cut = HISTORY_MSG_MAX_CHARS
+        display.append({**msg, "content": f"{content[:cut]}\n\n{TRUNCATED_NOTE.format(shown=cut, total=len(content))}"})
+    return display
+
+
+def _render_tool_section(tool_calls):
+    """构建工具调用折叠部分"""
+    if not tool_calls:
+        return ""
+    tool_items = []
+    for tool in tool_calls:
+        status = "✅ 成功" if tool['status'] else ("❌ 失败" if tool['status'] is False else "⏳ 处理中")
+        params = tool.get('params', '')
+        if params:
+            tool_items.append(f"• **{tool['name']}** - {status}\n  参数: `{params}`")
+        else:
+            tool_items.append(f"• **{tool['name']}** - {status}")
+
+    tool_list = "\n".join(tool_items)
+    return f"""<details>
+<summary>🔧 工具调用记录 ({len(tool_calls)})</summary>
+
+{tool_list}
+
+</details>
+
+---
+
+"""
+
+
+def chat_with_agent(message, history, tool_log, run_config=None, run_context=None):
     """
     与Agent对话的主函数
     
@@ -23,6 +83,8 @@ def chat_with_agent(message, history, tool_log):
         message: 用户输入
         history: 历史对话
         tool_log: 工具调用日志（不再使用，保留参数兼容性）
+        run_config: 会话配置（thread_id 等），默认使用全局 config
+        run_context: 运行时上下文，默认使用全局 context
     
     Yields:
         tuple: (历史对话, 当前回复, 工具日志)
@@ -41,26 +103,85 @@ def chat_with_agent(message, history, tool_log):
             if isinstance(msg, dict) and msg.get("role") == "assistant":
                 previous_ai_response = msg.get("content", "") or ""
                 break
+
+    # 后台预热消息中提到的股票的行情缓存
+    start_prefetch(message)
+
+    # 确定性查询走快速通道，不调用 LLM
+    fast_reply = route_message(message, (run_context or context).user_id)
+    if fast_reply is not None:
+        record_exchange(agent, run_config or config, message, fast_reply)
+        history[-1]["content"] = fast_reply
+        yield history, fast_reply, ""
+        return history, fast_reply, ""
     
     current_response = ""
+    answer = ""  # 本轮的回复正文（含交易建议和风险提示），不含工具面板
     seen_tool_calls = set()  # 记录已显示的工具调用，避免重复
     tool_calls = []  # 收集所有工具调用信息
+    scanned = 0  # values 模式下消息列表只会追加，已扫描过的消息不再重复处理
+    turn_offset = None  # 本轮新增消息在列表中的起始位置
+    structured_ready = False  # 本轮模型给出 ResponseFormat 之前，状态里的 structured_response 是上一轮的
+
+    # 工具面板只在内容变化时重建
+    tool_section = ""
+    tool_signature = None
+
+    # 按帧率合并推送
+    min_interval = 1.0 / UI_MAX_FPS if UI_MAX_FPS > 0 else 0.0
+    last_push = 0.0
+    pending = False
     
     # 定义需要显示的工具列表，排除内部工具
-    valid_tools = {'get_stock_code_by_name', 'analyze_stock_trend_detailed', 'get_valid_stock_data'}
+    valid_tools = {'get_stock_code_by_name', 'analyze_stock_trend_detailed', 'get_valid_stock_data', 'analyze_sectors', 'rank_stocks', 'analyze_intraday'}
     
+    # Agent 在后台线程中流式运行，事件经队列传回；两次事件之间也能按时推送被合并的帧
+    events = queue.Queue()
+    failure = []
+
+    def produce():
+        try:
+            for event in agent.stream(
+                {"messages": [{"role": "user", "content": message}]},
+                config=run_config or config,
+                context=run_context or context,
+                stream_mode="values"
+            ):
+                events.put(event)
+        except Exception as e:
+            failure.append(e)
+        finally:
+            events.put(_STREAM_DONE)
+
+    turn_start = time.perf_counter()
     try:
-        # 流式处理Agent响应
-        for event in agent.stream(
-            {"messages": [{"role": "user", "content": message}]},
-            config=config,
-            context=context,
-            stream_mode="values"
-        ):
+        threading.Thread(target=produce, daemon=True).start()
+        while True:
+            # 有待推送的帧时，最多等到下一次允许推送的时刻
+            timeout = max(0.0, min_interval - (time.monotonic() - last_push)) if pending else None
+            try:
+                event = events.get(timeout=timeout)
+            except queue.Empty:
+                last_push = time.monotonic()
+                pending = False
+                yield history, current_response, ""
+                continue
+            if event is _STREAM_DONE:
+                break
+
             # 检测工具调用
             if "messages" in event:
                 messages = event["messages"]
-                for msg in messages:
+                if len(messages) < scanned:
+                    scanned = 0
+                if turn_offset is None:
+                    turn_offset = len(messages)
+                for index, msg in enumerate(messages[scanned:], start=scanned):
+                    if index >= turn_offset and any(
+                        call.get('name') == ResponseFormat.__name__ for call in (getattr(msg, 'tool_calls', None) or [])
+                    ):
+                        structured_ready = True
+
                     # 检测是否有工具调用
                     if hasattr(msg, 'tool_calls') and msg.tool_calls:
                         for tool_call in msg.tool_calls:
@@ -118,59 +239,47 @@ def chat_with_agent(message, history, tool_log):
                                     break
                             
                             seen_tool_calls.add(f"result_{msg_id}")
+                scanned = len(messages)
             
+            # 工具调用新增或状态变化时重建工具面板
+            signature = tuple((tool['id'], tool['status']) for tool in tool_calls)
+            if signature != tool_signature:
+                tool_section = _render_tool_section(tool_calls)
+                tool_signature = signature
+
             # 获取AI的回复内容
-            if "structured_response" in event:
+            if structured_ready and "structured_response" in event:
                 structured = event["structured_response"]
                 if hasattr(structured, 'response'):
                     new_text = structured.response or ""
                     # 如果第一轮流式结果与上一条回复完全相同，则跳过，避免“重播”上一条回答
-                    if not current_response and previous_ai_response and new_text == previous_ai_response:
-                        continue
-                    # 构建工具调用折叠部分
-                    tool_section = ""
-                    if tool_calls:
-                        tool_items = []
-                        for tool in tool_calls:
-                            status = "✅ 成功" if tool['status'] else ("❌ 失败" if tool['status'] is False else "⏳ 处理中")
-                            params = tool.get('params', '')
-                            if params:
-                                tool_items.append(f"• **{tool['name']}** - {status}\n  参数: `{params}`")
-                            else:
-                                tool_items.append(f"• **{tool['name']}** - {status}")
-                        
-                        tool_list = "\n".join(tool_items)
-                        tool_section = f"""<details>
-<summary>🔧 工具调用记录 ({len(tool_calls)})</summary>
+                    if answer or not previous_ai_response or new_text != previous_ai_response:
+                        answer = new_text
+                        # 添加交易建议和风险提示
+                        if hasattr(structured, 'trading_decision') and structured.trading_decision:
+                            answer += f"\n\n📊 **交易建议:** {structured.trading_decision}"
+                        if hasattr(structured, 'risk_warning') and structured.risk_warning:
+                            answer += f"\n\n⚠️ **风险提示:** {structured.risk_warning}"
 
-{tool_list}
+            # 如果有工具调用信息，先显示，然后是AI回复；内容有变化才推送，且不超过帧率上限
+            current_response = tool_section + answer
+            if current_response != history[-1]["content"]:
+                history[-1]["content"] = current_response
+                pending = True
 
-</details>
+            now = time.monotonic()
+            if pending and now - last_push >= min_interval:
+                last_push = now
+                pending = False
+                yield history, current_response, ""
 
----
+        if failure:
+            raise failure[0]
 
-"""
-                    
-                    # 如果有工具调用信息，先显示，然后是AI回复
-                    if tool_section:
-                        current_response = tool_section + new_text
-                    else:
-                        current_response = new_text
-                    
-                    history[-1]["content"] = current_response
-                    yield history, current_response, ""
-                    
-                    # 添加交易建议和风险提示
-                    extra_info = ""
-                    if hasattr(structured, 'trading_decision') and structured.trading_decision:
-                        extra_info += f"\n\n📊 **交易建议:** {structured.trading_decision}"
-                    if hasattr(structured, 'risk_warning') and structured.risk_warning:
-                        extra_info += f"\n\n⚠️ **风险提示:** {structured.risk_warning}"
-                    
-                    if extra_info:
-                        current_response += extra_info
-                        history[-1]["content"] = current_response
-                        yield history, current_response, ""
+        # 推送被合并掉的最后一帧
+        if pending:
+            yield history, current_response, ""
+        router_stats.record_agent_latency(time.perf_counter() - turn_start)
     
     except Exception as e:
         error_msg = f"❌ 发生错误: {str(e)}"
@@ -256,31 +365,61 @@ with gr.Blocks(title="股票分析AI助手") as demo:
             - "000001最近30天的走势如何"
             - "什么板块适合投资"
             """)
+
+            # 自选股异动面板
+            with gr.Accordion("📡 自选股异动", open=False):
+                with gr.Row():
+                    watch_codes = gr.Textbox(
+                        placeholder="输入股票代码，用逗号分隔，例如：000001,600519",
+                        show_label=False,
+                        scale=4
+                    )
+                    watch_add_btn = gr.Button("加入监控", scale=1)
+                    watch_refresh_btn = gr.Button("刷新", scale=1)
+                watch_panel = gr.Markdown("暂无自选股异动")
     
     # 隐藏的状态组件和工具日志（保持兼容性）
     current_response = gr.State("")
     tool_log = gr.State("")
     last_user_msg = gr.State("")  # 记录上一次用户消息，避免重复显示
+    full_history = gr.State([])  # 完整对话历史只保存在服务端，页面上显示截断后的副本
     
     def handle_submit(user_msg, history, tool_log_state, last_msg):
         """处理用户提交，避免重复显示上一次回复
 
-        注意：不再返回 msg_input（由前端 JS 清空），因此返回/ yield 的输出数量为 4 项：
-        (chat_history, current_response, tool_log, last_user_msg)
+        注意：不再返回 msg_input（由前端 JS 清空），因此返回/ yield 的输出数量为 5 项：
+        (chat_history, current_response, tool_log, last_user_msg, full_history)
         """
         # 如果是同一条消息，不重复处理
         if user_msg == last_msg:
-            return history, "", tool_log_state, user_msg
+            return _display_history(history), "", tool_log_state, user_msg, history
 
-        # 调用聊天函数（流式）并 yield 出 4 项，供 Gradio 更新聊天历史等组件
+        # 调用聊天函数（流式）并 yield 出 5 项，供 Gradio 更新聊天历史等组件
         for h, resp, tl in chat_with_agent(user_msg, history, tool_log_state):
-            yield h, resp, tl, user_msg
+            yield _display_history(h), resp, tl, user_msg, h
     
     send_btn_event = send_btn.click(
         handle_submit,
-        inputs=[msg_input, chatbot, tool_log, last_user_msg],
-        outputs=[chatbot, current_response, tool_log, last_user_msg]
+        inputs=[msg_input, full_history, tool_log, last_user_msg],
+        outputs=[chatbot, current_response, tool_log, last_user_msg, full_history]
     )
+
+    def handle_watch_add(codes_text):
+        """加入自选股，建立基准快照"""
+        codes = [c.strip() for c in codes_text.replace("，", ",").split(",") if c.strip()]
+        if codes:
+            watchlist_monitor.watch(codes)
+        return handle_watch_refresh()
+
+    def handle_watch_refresh():
+        """读取最近的异动事件（由调度器或后台线程比较快照产生）"""
+        if not watchlist_monitor.codes:
+            return "暂无自选股，请先加入监控"
+        header = f"监控 {len(watchlist_monitor.codes)} 只，最近更新: {watchlist_monitor.last_update or '-'}\n\n"
+        return header + format_events_markdown(watchlist_monitor.recent(limit=50))
+
+    watch_add_btn.click(handle_watch_add, inputs=[watch_codes], outputs=[watch_panel])
+    watch_refresh_btn.click(handle_watch_refresh, outputs=[watch_panel])
     
     gr.Markdown("""
     ---
@@ -293,6 +432,8 @@ with gr.Blocks(title="股票分析AI助手") as demo:
 if __name__ == "__main__":
     print("🚀 启动股票分析AI助手...")
     print("📍 访问地址: http://localhost:7860")
+    start_equity_recorder()
+    start_scheduler()
     demo.launch(
         server_name="0.0.0.0",
         server_port=7860,
@@ -0,0 +1,194 @@
+"""
+快速通道路由 - 对确定性的查询（查代码、查持仓、查走势）直接调用工具并套用模板回复，不经过 LLM
+
+匹配失败、名称不是已知股票、工具报错或数据不够覆盖所问天数时返回 None，由调用方交给 Agent 处理。命中时调用方用 record_exchange
+把这一问一答写入 Agent 的会话线程，保证后续追问有上下文。命中率和节省的时间通过 router_stats 统计。
+"""
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from stock.market_cache import get_name_index
+from stock.stock_tools import (
+    Context,
+    analyze_stock_trend_detailed,
+    get_portfolio,
+    get_stock_code_by_name,
+)
+
+
+_PREFIX = r"^(?:请|帮我|麻烦)?(?:查询|查看|查一下|查查|查|看看|看一下)?\s*"
+
+# 查询股票代码：查询平安银行的股票代码 / 贵州茅台代码是多少
+CODE_PATTERN = re.compile(_PREFIX + r"(?P<name>[一-龥A-Za-z]{2,10}?)\s*的?(?:股票)?代码(?:是多少|是什么)?[？?。]?$")
+# 查询持仓：我的持仓 / 查看持仓 / 当前持仓情况
+PORTFOLIO_PATTERN = re.compile(_PREFIX + r"(?:我的|当前|现在的?)?(?:持仓|仓位|账户)(?:情况|信息|明细)?[？?。]?$")
+# 查询走势：000001最近30天走势 / 平安银行近7日走势如何
+TREND_PATTERN = re.compile(
+    _PREFIX + r"(?P<stock>\d{6}|[一-龥A-Za-z]{2,10}?)\s*(?:最近|近)\s*(?P<days>[1-9]\d*)\s*(?:天|日|个交易日)\s*的?"
+    r"(?:走势|趋势|行情)(?:如何|怎么样|怎样)?[？?。]?$"
+)
+
+# analyze_stock_trend_detailed 支持的周期
+PERIODS = [(7, "7d"), (30, "30d"), (90, "90d"), (180, "180d"), (365, "1y")]
+
+
+class RouterStats:
+    '''命中率与节省时间统计'''
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.fast_seconds = 0.0
+        self.agent_seconds = 0.0
+        self.agent_turns = 0
+        self._lock = threading.Lock()
+
+    def record_hit(self, seconds):
+        with self._lock:
+            self.hits += 1
+            self.fast_seconds += seconds
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def record_agent_latency(self, seconds):
+        with self._lock:
+            self.agent_turns += 1
+            self.agent_seconds += seconds
+
+    def snapshot(self):
+        with self._lock:
+            total = self.hits + self.misses
+            avg_fast = self.fast_seconds / self.hits if self.hits else 0.0
+            avg_agent = self.agent_seconds / self.agent_turns if self.agent_turns else None
+            saved = (avg_agent - avg_fast) * self.hits if avg_agent is not None else None
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate_pct': round(self.hits / total * 100, 1) if total else 0.0,
+                'avg_fast_ms': round(avg_fast * 1000, 1),
+                'avg_agent_ms': round(avg_agent * 1000, 1) if avg_agent is not None else None,
+                'saved_seconds_estimated': round(saved, 1) if saved is not None else None,
+            }
+
+
+router_stats = RouterStats()
+
+
+def _period_for(days):
+    for limit, period in PERIODS:
+        if days <= limit:
+            return period
+    return PERIODS[-1][1]
+
+
+def _is_stock_name(name):
+    '''名称必须出现在某只股票的名称中，避免把“如何查看”“问什么是”之类的普通词当成股票名'''
+    try:
+        names = get_name_index()['names']
+    except Exception:
+        return False
+    return name in names or any(name in n for n in names)
+
+
+def _invoke(tool, user_id=None, **kwargs):
+    '''直接调用工具函数；需要运行时上下文的工具传入与 Agent 相同结构的 runtime'''
+    if user_id is not None:
+        kwargs['runtime'] = SimpleNamespace(context=Context(user_id=user_id))
+    return tool.func(**kwargs)
+
+
+def _render_codes(result):
+    lines = [f"🔎 找到 {result['matched_count']} 只名称包含「{result['query_name']}」的股票："]
+    for stock in result['stocks'][:10]:
+        lines.append(f"- **{stock['stock_name']}**：`{stock['stock_code']}`，最新价 {stock['current_price']}，涨跌幅 {stock['change_pct']}%")
+    if result['matched_count'] > 10:
+        lines.append(f"- …… 其余 {result['matched_count'] - 10} 只未列出，请提供更完整的名称")
+    return "\n".join(lines)
+
+
+def _render_portfolio(result):
+    lines = [f"💼 当前现金：{result['cash']:,.2f} 元"]
+    if not result['positions']:
+        lines.append("当前没有持仓。")
+    for pos in result['positions']:
+        price = pos['market_price'] if pos['market_price'] is not None else "-"
+        value = f"{pos['market_value']:,.2f}" if pos['market_value'] is not None else "-"
+        pnl = ""
+        if pos['market_price'] is not None and pos['avg_cost']:
+            pnl = f"，浮动盈亏 {(pos['market_price'] / pos['avg_cost'] - 1) * 100:+.2f}%"
+        lines.append(f"- `{pos['stock_code']}`：{pos['shares']} 股，成本 {pos['avg_cost']}，现价 {price}，市值 {value}{pnl}")
+    lines.append(f"\n📊 估算总资产：{result['total_assets_estimated']:,.2f} 元")
+    return "\n".join(lines)
+
+
+def _render_trend(result, days):
+    meta = result['metadata']
+    data = result['raw_sequence']['recent_data'][-days:]
+    closes = [d['close'] for d in data]
+    change = (closes[-1] / closes[0] - 1) * 100 if closes and closes[0] else 0.0
+    lines = [
+        f"📈 **{meta['stock_name']}（{meta['stock_code']}）** 最近 {len(data)} 个交易日走势",
+        f"- 最新收盘：{meta['current_price']}",
+        f"- 区间涨跌：{change:+.2f}%，最高 {max(closes)}，最低 {min(closes)}",
+        "",
+        "| 日期 | 收盘 | 成交量异动 |",
+        "| --- | --- | --- |",
+    ]
+    for d in data[-10:]:
+        lines.append(f"| {d['date']} | {d['close']} | {d['vol_change']} |")
+    return "\n".join(lines)
+
+
+def route_message(message, user_id="1"):
+    '''尝试用快速通道回答，命中返回回复文本，否则返回 None'''
+    text = message.strip()
+    start = time.perf_counter()
+    reply = None
+
+    if PORTFOLIO_PATTERN.match(text):
+        reply = _render_portfolio(_invoke(get_portfolio, user_id=user_id))
+    elif (m := TREND_PATTERN.match(text)) and (m.group('stock').isdigit() or _is_stock_name(m.group('stock'))):
+        days = int(m.group('days'))
+        result = _invoke(analyze_stock_trend_detailed, stock_identifier=m.group('stock'), period=_period_for(days))
+        # 工具报错（找不到股票、名称不唯一等）或数据不够覆盖所问的天数（工具只取约两个月日线），交给 Agent 处理
+        if 'error' not in result and len(result['raw_sequence']['recent_data']) >= days:
+            reply = _render_trend(result, days)
+    elif (m := CODE_PATTERN.match(text)) and _is_stock_name(m.group('name')):
+        result = _invoke(get_stock_code_by_name, stock_name=m.group('name'))
+        if 'error' not in result:
+            reply = _render_codes(result)
+
+    if reply is None:
+        router_stats.record_miss()
+        return None
+
+    elapsed = time.perf_counter() - start
+    router_stats.record_hit(elapsed)
+    stats = router_stats.snapshot()
+    print(f"⚡ 快速通道命中 ({elapsed * 1000:.0f}ms)，累计命中率 {stats['hit_rate_pct']}%，"
+          f"估计节省 {stats['saved_seconds_estimated'] or '-'}s", flush=True)
+    return reply
+
+
+def record_exchange(agent, config, message, reply):
+    '''
+    把快速通道的一问一答写入 Agent 的会话线程（checkpointer），后续追问（如“卖掉刚才那只”）能看到上下文。
+    同时清空上一轮的 structured_response，避免下一轮开始时界面先显示旧回答。
+    '''
+    try:
+        agent.update_state(
+            config,
+            {
+                "messages": [HumanMessage(content=message), AIMessage(content=reply)],
+                "structured_response": None,
+            },
+            as_node="model",
+        )
+    except Exception as e:
+        print(f"快速通道写入会话历史失败: {e}", flush=True)
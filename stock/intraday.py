@@ -0,0 +1,278 @@
+"""
+分时数据 - 1/5/15 分钟K线，按股票保存在固定长度的 NumPy 环形缓冲区中
+
+每次只拉取上次之后的新K线；缓冲区数量有上限（LRU 淘汰），跟踪多少只股票内存都有界。
+"""
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+import akshare as ak
+import numpy as np
+import pandas as pd
+from langchain.tools import tool, ToolRuntime
+
+from stock import trading_calendar
+from stock.stock_tools import _get_portfolio_state, _runtime_user_id
+
+
+PERIODS = ("1", "5", "15")
+# 每个缓冲区保存的K线数量（1分钟约两个交易日）
+BUFFER_CAPACITY = {"1": 480, "5": 480, "15": 320}
+# 同时保留的缓冲区数量上限
+MAX_SERIES = 200
+# 成交量放大倍数超过该值视为异动
+VOLUME_SPIKE_RATIO = 3.0
+
+
+def _to_datetime(ts):
+    # 时间戳由不带时区的行情时间直接换算，还原时同样不做时区转换
+    return pd.Timestamp(int(ts), unit='s').to_pydatetime()
+
+
+class MinuteRingBuffer:
+    '''
+    固定容量的分钟K线环形缓冲区，时间戳为 int64 秒，价格和成交量为 float32
+
+    lock 保护 start/size 与各列的一致性：增量更新从读取 last_ts 到 append 结束都要持有，view 读取时也会持有。
+    '''
+
+    __slots__ = ('capacity', 'ts', 'open', 'high', 'low', 'close', 'volume', 'amount', 'start', 'size', 'lock')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.ts = np.zeros(capacity, dtype=np.int64)
+        self.open = np.zeros(capacity, dtype=np.float32)
+        self.high = np.zeros(capacity, dtype=np.float32)
+        self.low = np.zeros(capacity, dtype=np.float32)
+        self.close = np.zeros(capacity, dtype=np.float32)
+        self.volume = np.zeros(capacity, dtype=np.float32)
+        self.amount = np.zeros(capacity, dtype=np.float64)
+        self.start = 0
+        self.size = 0
+        self.lock = threading.Lock()
+
+    @property
+    def last_ts(self):
+        if self.size == 0:
+            return None
+        return int(self.ts[(self.start + self.size - 1) % self.capacity])
+
+    def append(self, ts, open_, high, low, close, volume, amount):
+        '''追加一批按时间排序的K线；与最后一根时间相同的K线覆盖（盘中未走完的K线会更新）'''
+        last = self.last_ts
+        if last is not None:
+            keep = ts >= last
+            ts, open_, high, low, close, volume, amount = (
+                a[keep] for a in (ts, open_, high, low, close, volume, amount)
+            )
+            if len(ts) and ts[0] == last:
+                # 去掉最后一根，新数据从它的位置重新写入
+                self.size -= 1
+        n = len(ts)
+        if n == 0:
+            return 0
+        if n > self.capacity:
+            ts, open_, high, low, close, volume, amount = (
+                a[-self.capacity:] for a in (ts, open_, high, low, close, volume, amount)
+            )
+            n = self.capacity
+
+        idx = (self.start + self.size + np.arange(n)) % self.capacity
+        self.ts[idx] = ts
+        self.open[idx] = open_
+        self.high[idx] = high
+        self.low[idx] = low
+        self.close[idx] = close
+        self.volume[idx] = volume
+        self.amount[idx] = amount
+
+        overflow = max(0, self.size + n - self.capacity)
+        self.start = (self.start + overflow) % self.capacity
+        self.size = min(self.capacity, self.size + n)
+        return n
+
+    def view(self, last_n=None):
+        '''按时间顺序返回最近 last_n 根K线的各列副本'''
+        with self.lock:
+            return self._view(last_n)
+
+    def _view(self, last_n):
+        n = self.size if last_n is None else min(last_n, self.size)
+        idx = (self.start + self.size - n + np.arange(n)) % self.capacity
+        return {
+            'ts': self.ts[idx],
+            'open': self.open[idx],
+            'high': self.high[idx],
+            'low': self.low[idx],
+            'close': self.close[idx],
+            'volume': self.volume[idx],
+            'amount': self.amount[idx],
+        }
+
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ('ts', 'open', 'high', 'low', 'close', 'volume', 'amount'))
+
+
+class IntradayStore:
+    '''按 (代码, 周期) 管理环形缓冲区，超过上限时淘汰最久未使用的'''
+
+    def __init__(self, max_series=MAX_SERIES):
+        self.max_series = max_series
+        self._buffers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _buffer(self, code, period):
+        key = (code, period)
+        with self._lock:
+            buf = self._buffers.get(key)
+            if buf is None:
+                buf = MinuteRingBuffer(BUFFER_CAPACITY[period])
+                self._buffers[key] = buf
+                while len(self._buffers) > self.max_series:
+                    self._buffers.popitem(last=False)
+            else:
+                self._buffers.move_to_end(key)
+            return buf
+
+    def update(self, code, period="5"):
+        '''只拉取缓冲区最后一根K线之后的数据（包含最后一根，用于更新未走完的K线）'''
+        if period not in PERIODS:
+            raise ValueError(f"不支持的周期: {period}，可选 {PERIODS}")
+        buf = self._buffer(code, period)
+        # 同一 (代码, 周期) 的并发更新串行执行，避免交错修改 start/size 造成K线重复或丢失
+        with buf.lock:
+            now = trading_calendar.now()
+            if buf.last_ts is None:
+                start = (now - timedelta(days=5)).strftime('%Y-%m-%d 09:30:00')
+            else:
+                start = _to_datetime(buf.last_ts).strftime('%Y-%m-%d %H:%M:%S')
+
+            df = ak.stock_zh_a_hist_min_em(
+                symbol=code, start_date=start, end_date=now.strftime('%Y-%m-%d %H:%M:%S'),
+                period=period, adjust=""
+            )
+            if df is None or len(df) == 0:
+                return buf, 0
+
+            # 先统一到秒精度再取整数（新版 pandas 解析字符串时不一定是纳秒精度）
+            ts = pd.to_datetime(df['时间']).to_numpy(dtype='datetime64[s]').astype(np.int64)
+            order = np.argsort(ts, kind='stable')
+            cols = [pd.to_numeric(df[c], errors='coerce').to_numpy()[order] for c in ('开盘', '最高', '最低', '收盘', '成交量', '成交额')]
+            added = buf.append(ts[order], *cols)
+        return buf, added
+
+    def memory_bytes(self):
+        with self._lock:
+            return sum(buf.nbytes() for buf in self._buffers.values())
+
+    def __len__(self):
+        return len(self._buffers)
+
+
+intraday_store = IntradayStore()
+
+
+def intraday_metrics(bars, lookback=20):
+    '''基于当日K线计算 VWAP、振幅区间和成交量异动'''
+    ts = bars['ts']
+    if len(ts) == 0:
+        return None
+    # 只取最后一个交易日
+    day = _to_datetime(ts[-1]).date()
+    day_start = int(pd.Timestamp(day).value // 10**9)
+    mask = ts >= day_start
+    close = bars['close'][mask].astype(np.float64)
+    high = bars['high'][mask].astype(np.float64)
+    low = bars['low'][mask].astype(np.float64)
+    volume = bars['volume'][mask].astype(np.float64)
+    amount = bars['amount'][mask]
+    open_price = float(bars['open'][mask][0])
+
+    # 成交量单位为手，VWAP = 成交额 / (成交量 * 100)
+    total_shares = volume.sum() * 100
+    vwap = float(amount.sum() / total_shares) if total_shares > 0 else float('nan')
+    day_high, day_low = float(high.max()), float(low.min())
+    last = float(close[-1])
+
+    # 每根K线成交量与之前 lookback 根均量之比（向量化滑动均值）
+    vol_all = bars['volume'].astype(np.float64)
+    csum = np.concatenate(([0.0], np.cumsum(vol_all)))
+    idx = np.arange(len(vol_all))
+    lo = np.maximum(0, idx - lookback)
+    counts = idx - lo
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prev_mean = (csum[idx] - csum[lo]) / counts
+        ratio = vol_all / prev_mean
+    ratio = ratio[mask]
+    spike_idx = np.nonzero(np.isfinite(ratio) & (ratio >= VOLUME_SPIKE_RATIO))[0]
+
+    spikes = [
+        {
+            'time': _to_datetime(ts[mask][i]).strftime('%H:%M'),
+            'close': round(float(close[i]), 2),
+            'volume_ratio': round(float(ratio[i]), 1),
+        }
+        for i in spike_idx[-10:]
+    ]
+
+    return {
+        'date': day.strftime('%Y-%m-%d'),
+        'bars': int(mask.sum()),
+        'open': round(open_price, 2),
+        'last': round(last, 2),
+        'vwap': round(vwap, 3),
+        'last_vs_vwap_pct': round((last / vwap - 1) * 100, 2) if vwap == vwap else None,
+        'high': round(day_high, 2),
+        'low': round(day_low, 2),
+        'range_pct': round((day_high - day_low) / open_price * 100, 2) if open_price else None,
+        'last_volume_ratio': round(float(ratio[-1]), 1) if np.isfinite(ratio[-1]) else None,
+        'volume_spikes': spikes,
+    }
+
+
+@tool
+def analyze_intraday(stock_code: str, period: str = "5", runtime: ToolRuntime = None):
+    '''
+    分时走势分析（1/5/15 分钟K线），用于盘中止损/止盈判断
+
+    参数:
+        stock_code: 股票代码，例如"600519"
+        period: K线周期，"1"、"5" 或 "15"（分钟），默认"5"
+
+    返回:
+        当日 VWAP、最新价相对 VWAP 的偏离、日内高低点和振幅、成交量异动K线，
+        如果持有该股票，还包括成本价和止损/止盈价位
+    '''
+    print(f"分时分析: {stock_code}, 周期: {period}分钟", flush=True)
+    try:
+        buf, added = intraday_store.update(stock_code, period)
+        metrics = intraday_metrics(buf.view())
+        if metrics is None:
+            return {'error': f'暂无股票 {stock_code} 的分时数据'}
+
+        result = {
+            'stock_code': stock_code,
+            'period': f"{period}min",
+            'new_bars': added,
+            **metrics,
+        }
+
+        position = _get_portfolio_state(_runtime_user_id(runtime))['positions'].get(stock_code)
+        if position:
+            stop_loss_price = position.stop_loss_price
+            result['position'] = {
+                'shares': position.shares,
+                'avg_cost': round(position.avg_cost, 2),
+                'stop_loss_price': stop_loss_price,
+                'take_profit_price': position.take_profit_price,
+                'intraday_low_hit_stop': bool(stop_loss_price is not None and metrics['low'] <= stop_loss_price),
+            }
+        return result
+    except Exception as e:
+        return {'error': f"分时分析失败: {str(e)}"}
+
+
+intraday_tools = [
+    analyze_intraday,
+]
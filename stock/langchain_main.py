@@ -1,6 +1,12 @@
 # pip install -qU langchain "langchain[anthropic]"
 from stock.agent_config import agent
 from stock.stock_tools import Context
+from stock.portfolio_risk import start_equity_recorder
+from stock.intent_router import record_exchange, route_message, router_stats
+from stock.prefetch import start_prefetch
+from stock.market_cache import cache_stats
+from stock.scheduler import start_scheduler
+import time
 
 
 
@@ -17,6 +23,8 @@ def chat_console(agent):
             user_input = input("\n👤 你: ").strip()
             
             if user_input.lower() in ['quit', 'exit', '退出', 'q']:
+                print(f"⚡ 快速通道统计: {router_stats.snapshot()}")
+                print(f"🔮 缓存/预取统计: {cache_stats()}")
                 print("👋 再见！")
                 break
                 
@@ -25,7 +33,18 @@ def chat_console(agent):
                 
             # 调用代理（流式输出）
             print("\n🤖 AI: ", end="", flush=True)
+
+            # 后台预热消息中提到的股票的行情缓存
+            start_prefetch(user_input)
+
+            # 确定性查询走快速通道，不调用 LLM
+            fast_reply = route_message(user_input, context.user_id)
+            if fast_reply is not None:
+                record_exchange(agent, config, user_input, fast_reply)
+                print(fast_reply)
+                continue
             
+            turn_start = time.perf_counter()
             response_text = ""
             final_result = None
             
@@ -61,6 +80,7 @@ def chat_console(agent):
                                     response_text = last_message.content
             
             print()  # 换行
+            router_stats.record_agent_latency(time.perf_counter() - turn_start)
             
             # 如果有交易决策或风险提示，显示出来
             if final_result and "structured_response" in final_result:
@@ -78,6 +98,8 @@ def chat_console(agent):
 
 
 if __name__ == "__main__":
+    start_equity_recorder()
+    start_scheduler()
     chat_console(agent)
 
 
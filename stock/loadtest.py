@@ -0,0 +1,303 @@
+"""
+并发会话压测 - 用确定性的桩模型和回放行情驱动 gradio_ui.chat_with_agent
+
+桩模型按脚本依次发起工具调用（可配置思考延迟），最后返回 ResponseFormat 结构化结果；
+行情和交易日历接口替换为回放数据，不访问 DeepSeek、东方财富和新浪。名称索引、交易日历和账户文件
+写入临时目录，不覆盖 data/ 下的真实数据。
+
+运行:
+    uv run python -m stock.loadtest -n 20 -t 5 --think-delay 0.2
+录制行情（需要联网，之后可用 --market-file 回放）:
+    uv run python -m stock.loadtest --record data/loadtest_market.pkl
+"""
+import argparse
+import json
+import os
+import pickle
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langgraph.checkpoint.memory import MemorySaver
+
+# 桩模型不会真正请求 DeepSeek，但 agent_config 在导入时会初始化线上模型
+os.environ.setdefault("DEEPSEEK_API_KEY", "loadtest")
+
+import akshare as ak
+from stock import gradio_ui, market_cache, stock_tools, trading_calendar
+from stock.agent_config import build_agent
+from stock.stock_tools import Context
+
+
+STOCK_DATA_FILE = "data/stock_data.json"
+
+# 默认脚本：查代码 -> 分析走势 -> 查持仓，{code}/{name} 会替换为本轮提到的股票
+DEFAULT_SCRIPT = [
+    ("get_stock_code_by_name", {"stock_name": "{name}"}),
+    ("analyze_stock_trend_detailed", {"stock_identifier": "{code}", "period": "30d"}),
+    ("get_portfolio", {}),
+]
+
+DEFAULT_PROMPT = "帮我分析一下{name}({code})最近的走势"
+
+
+class StubChatModel(BaseChatModel):
+    """按脚本发起工具调用的确定性聊天模型"""
+
+    script: list = DEFAULT_SCRIPT
+    think_delay: float = 0.0
+    response_template: str = "【压测回复】{name}({code}) 走势分析完成，建议观望。"
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.think_delay > 0:
+            time.sleep(self.think_delay)
+
+        # 本轮（最后一条用户消息之后）已完成的工具调用数决定脚本进度
+        step = 0
+        user_text = ""
+        for msg in reversed(messages):
+            if isinstance(msg, HumanMessage):
+                user_text = msg.content if isinstance(msg.content, str) else str(msg.content)
+                break
+            if isinstance(msg, ToolMessage):
+                step += 1
+
+        code_match = re.search(r"\d{6}", user_text)
+        name_match = re.search(r"分析一下(\S+?)\(", user_text)
+        values = {
+            "code": code_match.group(0) if code_match else "000001",
+            "name": name_match.group(1) if name_match else "平安银行",
+        }
+
+        if step < len(self.script):
+            name, args = self.script[step]
+            args = {k: v.format(**values) if isinstance(v, str) else v for k, v in args.items()}
+        else:
+            name, args = "ResponseFormat", {"response": self.response_template.format(**values)}
+
+        message = AIMessage(
+            content="",
+            tool_calls=[{"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:12]}"}],
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+# ====== 行情回放 ======
+
+def load_spot_snapshot(path=STOCK_DATA_FILE):
+    """读取已保存的全市场快照（get_valid_stock_data 的输出）"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return pd.DataFrame(list(data["stocks"].values()))
+
+
+def synthetic_history(code, last_close, days=120):
+    """按股票代码生成确定性的日线数据（随机游走，最后一天收盘价对齐快照）"""
+    rng = np.random.default_rng(int(code))
+    returns = rng.normal(0, 0.02, days)
+    log_path = np.cumsum(returns)
+    closes = last_close * np.exp(log_path - log_path[-1])
+    volumes = rng.integers(50_000, 500_000, days).astype(float)
+    end = trading_calendar.now()
+    dates = [(end - timedelta(days=days - i)).strftime('%Y-%m-%d') for i in range(days)]
+    return pd.DataFrame({
+        '日期': dates,
+        '开盘': closes,
+        '收盘': closes,
+        '最高': closes * 1.01,
+        '最低': closes * 0.99,
+        '成交量': volumes,
+        '成交额': volumes * closes * 100,
+        '换手率': rng.uniform(0.5, 5, days),
+    })
+
+
+class ReplayMarket:
+    """替换 akshare 行情接口的回放数据源"""
+
+    def __init__(self, spot_df, history=None):
+        self.spot_df = spot_df
+        self.history = history or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        return cls(data["spot"], data["hist"])
+
+    def stock_zh_a_spot_em(self):
+        return self.spot_df.copy()
+
+    def stock_zh_a_hist(self, symbol, period="daily", start_date=None, end_date=None, adjust=""):
+        with self._lock:
+            df = self.history.get(symbol)
+            if df is None:
+                row = self.spot_df[self.spot_df['代码'] == symbol]
+                last_close = float(row.iloc[0]['最新价']) if len(row) else 10.0
+                df = synthetic_history(symbol, last_close)
+                self.history[symbol] = df
+        return df.copy()
+
+    def tool_trade_date_hist_sina(self):
+        # 回放时按工作日作为交易日
+        today = trading_calendar.now().date()
+        dates = pd.bdate_range(today - timedelta(days=365), today + timedelta(days=365))
+        return pd.DataFrame({'trade_date': dates.date})
+
+    def install(self):
+        """替换行情和交易日历接口，并把会落盘的缓存和账户文件重定向到临时目录"""
+        ak.stock_zh_a_spot_em = self.stock_zh_a_spot_em
+        ak.stock_zh_a_hist = self.stock_zh_a_hist
+        ak.tool_trade_date_hist_sina = self.tool_trade_date_hist_sina
+
+        self.data_dir = tempfile.mkdtemp(prefix="loadtest-")
+        market_cache.NAME_INDEX_FILE = os.path.join(self.data_dir, "stock_names.json")
+        market_cache._name_index = None
+        trading_calendar.TRADE_DATES_FILE = os.path.join(self.data_dir, "trade_dates.json")
+        trading_calendar._trade_dates = None
+        stock_tools.PORTFOLIO_DIR = os.path.join(self.data_dir, "portfolios")
+
+
+def record_market_data(path, max_codes=200):
+    """联网录制一份行情快照和部分股票的日线，供回放使用"""
+    spot_df = ak.stock_zh_a_spot_em()
+    codes = spot_df.sort_values('总市值', ascending=False)['代码'].head(max_codes).tolist()
+    end = trading_calendar.now()
+    history = {}
+    for code in codes:
+        try:
+            history[code] = ak.stock_zh_a_hist(
+                symbol=code, period="daily",
+                start_date=(end - timedelta(days=120)).strftime('%Y%m%d'),
+                end_date=end.strftime('%Y%m%d'),
+                adjust="qfq"
+            )
+        except Exception as e:
+            print(f"录制失败: {code}, {e}", flush=True)
+    with open(path, "wb") as f:
+        pickle.dump({"spot": spot_df, "hist": history}, f)
+    print(f"已录制 {len(history)} 只股票到 {path}")
+
+
+# ====== 压测 ======
+
+def _rss_mb():
+    """当前常驻内存（MB），读取 /proc/self/statm；不支持时退化为峰值"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        return _peak_rss_mb()
+
+
+def _peak_rss_mb():
+    # Linux 下 ru_maxrss 单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_session(session_id, turns, stocks, prompt_template=DEFAULT_PROMPT):
+    """模拟一个用户连续对话 turns 轮，返回每轮耗时和错误数"""
+    run_config = {"configurable": {"thread_id": f"loadtest-{session_id}"}, "recursion_limit": 50}
+    run_context = Context(user_id=f"loadtest_{session_id}")
+    history = []
+    latencies = []
+    errors = 0
+    for turn in range(turns):
+        code, name = stocks[(session_id * turns + turn) % len(stocks)]
+        message = prompt_template.format(code=code, name=name)
+        start = time.perf_counter()
+        final = ""
+        for _, response, _ in gradio_ui.chat_with_agent(message, history, "", run_config=run_config, run_context=run_context):
+            final = response
+        latencies.append(time.perf_counter() - start)
+        if not final or final.startswith("❌"):
+            errors += 1
+    return latencies, errors
+
+
+def run_load_test(sessions, turns, think_delay=0.0, market=None, script=None):
+    """并发运行 sessions 个会话，返回延迟分位数、吞吐量和内存增长"""
+    market = market or ReplayMarket(load_spot_snapshot())
+    market.install()
+
+    model = StubChatModel(think_delay=think_delay, script=script or DEFAULT_SCRIPT)
+    gradio_ui.agent = build_agent(model, MemorySaver())
+
+    stocks = list(market.spot_df[['代码', '名称']].itertuples(index=False, name=None))
+
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        results = list(pool.map(lambda i: run_session(i, turns, stocks), range(sessions)))
+    wall = time.perf_counter() - start
+
+    rss_after = _rss_mb()
+
+    latencies = np.array([x for lat, _ in results for x in lat])
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0, 0, 0)
+    return {
+        "sessions": sessions,
+        "turns_per_session": turns,
+        "think_delay_sec": think_delay,
+        "total_turns": int(len(latencies)),
+        "errors": int(sum(err for _, err in results)),
+        "wall_sec": round(wall, 3),
+        "throughput_turns_per_sec": round(len(latencies) / wall, 2) if wall > 0 else None,
+        "latency_p50_ms": round(float(p50) * 1000, 1),
+        "latency_p95_ms": round(float(p95) * 1000, 1),
+        "latency_p99_ms": round(float(p99) * 1000, 1),
+        "rss_before_mb": round(rss_before, 1),
+        "rss_after_mb": round(rss_after, 1),
+        "rss_growth_mb": round(rss_after - rss_before, 1),
+        "rss_peak_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="股票Agent并发会话压测")
+    parser.add_argument("-n", "--sessions", type=int, default=10, help="并发会话数")
+    parser.add_argument("-t", "--turns", type=int, default=3, help="每个会话的对话轮数")
+    parser.add_argument("--think-delay", type=float, default=0.0, help="桩模型每次调用的思考延迟（秒）")
+    parser.add_argument("--market-file", help="录制的行情文件（默认回放 data/stock_data.json 并生成日线）")
+    parser.add_argument("--record", metavar="PATH", help="联网录制行情到 PATH 后退出")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record_market_data(args.record)
+        return 0
+
+    market = ReplayMarket.from_file(args.market_file) if args.market_file else None
+    report = run_load_test(args.sessions, args.turns, think_delay=args.think_delay, market=market)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+    else:
+        print("📈 压测结果")
+        for key, value in report.items():
+            print(f"  {key}: {value}")
+    return 0 if report["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
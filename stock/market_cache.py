@@ -0,0 +1,188 @@
+"""
+行情缓存 - 全市场快照、日线和股票名称索引的进程内缓存
+
+同一个键同时只会有一次下载（其他调用方等待结果），预取写入的缓存被工具（from_tool=True）命中时才计入预取命中率，
+名称索引、自选股、调度器等内部读取不算。缓存条目数有上限，超出后按最近最少使用淘汰。
+时效按交易日历判断：盘中按 TTL 过期，休市期间获取的数据一直有效到下一次开盘。
+"""
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+import akshare as ak
+
+from stock import trading_calendar
+
+
+# 盘中快照有效期（秒），交易类工具按这个时效取价
+SPOT_TTL = float(os.getenv("SPOT_TTL", "15"))
+# 盘中日线有效期（秒）
+HIST_TTL = float(os.getenv("HIST_TTL", "300"))
+# 日线缓存最多保留的条目数（每个条目是一只股票一天的一份日线）
+HIST_MAX_ENTRIES = int(os.getenv("HIST_MAX_ENTRIES", "512"))
+NAME_INDEX_FILE = "data/stock_names.json"
+
+
+class TTLCache:
+    '''带有效期和单飞（single-flight）加载的缓存'''
+
+    def __init__(self, name, max_entries=None):
+        self.name = name
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> (写入时的北京时间, 值)，按最近使用排序
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # 由预取写入、尚未被使用的键
+        self._prefetched = set()
+        self.prefetch_loads = 0
+        self.prefetch_hits = 0
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _fresh(self, key, ttl):
+        entry = self._data.get(key)
+        if entry is not None and trading_calendar.is_fresh(entry[0], ttl):
+            return entry
+        return None
+
+    def _evict(self):
+        '''超出上限时淘汰最久未使用的条目（调用方持有 self._lock）'''
+        while self.max_entries and len(self._data) > self.max_entries:
+            key, _ = self._data.popitem(last=False)
+            self._prefetched.discard(key)
+            lock = self._key_locks.get(key)
+            if lock is not None and not lock.locked():
+                del self._key_locks[key]
+
+    def get_or_load(self, key, loader, ttl, prefetch=False, from_tool=False):
+        entry = self._fresh(key, ttl)
+        if entry is None:
+            with self._key_lock(key):
+                # 等锁期间可能已被其他线程（例如预取）加载
+                entry = self._fresh(key, ttl)
+                if entry is None:
+                    value = loader()
+                    entry = (trading_calendar.now(), value)
+                    with self._lock:
+                        self._data[key] = entry
+                        self._data.move_to_end(key)
+                        self._evict()
+                        if prefetch:
+                            self._prefetched.add(key)
+                            self.prefetch_loads += 1
+                        else:
+                            self.misses += 1
+                    return value
+
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+            if not prefetch:
+                self.hits += 1
+                if from_tool and key in self._prefetched:
+                    self._prefetched.discard(key)
+                    self.prefetch_hits += 1
+        return entry[1]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate_pct': round(self.hits / total * 100, 1) if total else 0.0,
+                'prefetch_loads': self.prefetch_loads,
+                'prefetch_hits': self.prefetch_hits,
+                'prefetch_hit_rate_pct': round(self.prefetch_hits / self.prefetch_loads * 100, 1)
+                if self.prefetch_loads else 0.0,
+            }
+
+
+spot_cache = TTLCache("spot")
+hist_cache = TTLCache("hist", max_entries=HIST_MAX_ENTRIES)
+
+
+def get_spot_snapshot(max_age=SPOT_TTL, prefetch=False, from_tool=False):
+    '''全市场实时行情（ak.stock_zh_a_spot_em），盘中 max_age 秒内复用同一份快照；工具内调用时传 from_tool=True'''
+    return spot_cache.get_or_load("spot", ak.stock_zh_a_spot_em, max_age, prefetch=prefetch, from_tool=from_tool)
+
+
+def get_daily_history(stock_code, days=60, adjust="qfq", max_age=HIST_TTL, prefetch=False, from_tool=False):
+    '''最近 days 个自然日的日线（ak.stock_zh_a_hist），返回的 DataFrame 请勿原地修改'''
+    today = trading_calendar.now()
+
+    def _load():
+        return ak.stock_zh_a_hist(
+            symbol=stock_code, period="daily",
+            start_date=(today - timedelta(days=days)).strftime('%Y%m%d'),
+            end_date=today.strftime('%Y%m%d'),
+            adjust=adjust
+        )
+
+    key = (stock_code, days, adjust, today.strftime('%Y%m%d'))
+    return hist_cache.get_or_load(key, _load, max_age, prefetch=prefetch, from_tool=from_tool)
+
+
+# ====== 股票名称索引 ======
+
+_name_index = None  # {'date': 日期, 'names': {名称: 代码}, 'codes': {代码: 名称}, 'pattern': 编译好的名称正则}
+_name_lock = threading.Lock()
+
+
+def _build_index(names):
+    # 长名称优先匹配，避免“平安”抢先匹配“平安银行”
+    ordered = sorted(names, key=len, reverse=True)
+    pattern = re.compile("|".join(re.escape(n) for n in ordered)) if ordered else None
+    return {
+        'date': trading_calendar.now().strftime('%Y-%m-%d'),
+        'names': names,
+        'codes': {code: name for name, code in names.items()},
+        'pattern': pattern,
+    }
+
+
+def get_name_index(force_refresh=False):
+    '''股票名称 -> 代码 索引，每天从快照重建一次并保存到文件'''
+    global _name_index
+    today = trading_calendar.now().strftime('%Y-%m-%d')
+    with _name_lock:
+        if _name_index and _name_index['date'] == today and not force_refresh:
+            return _name_index
+
+        names = None
+        if not force_refresh:
+            try:
+                with open(NAME_INDEX_FILE, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("date") == today:
+                    names = data["names"]
+            except Exception:
+                names = None
+
+        if names is None:
+            spot_df = get_spot_snapshot()
+            names = dict(zip(spot_df['名称'].astype(str), spot_df['代码'].astype(str)))
+            try:
+                with open(NAME_INDEX_FILE, "w", encoding="utf-8") as f:
+                    json.dump({"date": today, "names": names}, f, ensure_ascii=False)
+            except Exception:
+                # 索引写入失败不影响查询
+                pass
+
+        _name_index = _build_index(names)
+        return _name_index
+
+
+def cache_stats():
+    return {
+        'spot': spot_cache.stats(),
+        'hist': hist_cache.stats(),
+    }
@@ -0,0 +1,255 @@
+"""
+组合风险分析 - 定时盯市记录权益曲线，并基于本地缓存的日线计算收益、回撤、波动率、持仓贡献和相关性
+"""
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from langchain.tools import tool, ToolRuntime
+
+from stock.price_matrix import get_price_matrix
+from stock.records import positions_to_array, value_positions
+from stock import trading_calendar
+from stock.trading_calendar import is_market_open, last_session_date, next_open, seconds_until
+from stock.stock_tools import (
+    DEFAULT_USER_ID,
+    _get_latest_prices,
+    _get_portfolio_state,
+    _portfolio_states,
+    _runtime_user_id,
+    _safe_user_id,
+)
+
+
+EQUITY_DIR = "data/equity_curve"
+TRADING_DAYS = 252
+
+# 各用户的权益曲线，首次访问时从文件加载，之后只追加
+_curves = {}
+_curve_lock = threading.RLock()
+
+# 代码 -> 最近一次尝试回填的交易日（包括失败的），同一交易日内不重复下载
+_backfill_attempts = {}
+
+
+def _curve_file(user_id):
+    return os.path.join(EQUITY_DIR, f"{_safe_user_id(user_id)}.jsonl")
+
+
+def load_equity_curve(user_id=DEFAULT_USER_ID):
+    '''读取权益曲线记录列表（按时间顺序）'''
+    with _curve_lock:
+        curve = _curves.get(user_id)
+        if curve is None:
+            curve = []
+            try:
+                with open(_curve_file(user_id), "r", encoding="utf-8") as f:
+                    curve = [json.loads(line) for line in f if line.strip()]
+            except FileNotFoundError:
+                pass
+            _curves[user_id] = curve
+        return curve
+
+
+def record_equity_snapshot(user_id=DEFAULT_USER_ID, prices=None):
+    '''盯市一次并追加到权益曲线；prices 为空时批量查询一次行情'''
+    state = _get_portfolio_state(user_id)
+    positions = state['positions']
+    if prices is None:
+        prices = _get_latest_prices(positions.keys(), from_tool=False)
+
+    pos_arr = positions_to_array(positions)
+    _, market_values, _ = value_positions(pos_arr, prices)
+    # 取不到行情时按成本估值，避免曲线出现断崖
+    missing = np.isnan(market_values)
+    market_values[missing] = pos_arr['avg_cost'][missing] * pos_arr['shares'][missing]
+    values = {str(code): round(float(v), 2) for code, v in zip(pos_arr['code'], market_values)}
+
+    market_value = float(market_values.sum())
+    record = {
+        'time': trading_calendar.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'cash': round(state['cash'], 2),
+        'market_value': round(market_value, 2),
+        'total': round(state['cash'] + market_value, 2),
+        'positions': values,
+    }
+
+    with _curve_lock:
+        load_equity_curve(user_id).append(record)
+        try:
+            os.makedirs(EQUITY_DIR, exist_ok=True)
+            with open(_curve_file(user_id), "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception:
+            # 持久化失败不影响内存中的曲线
+            pass
+    return record
+
+
+def record_all_snapshots(user_ids=None):
+    '''为多个账户盯市：所有持仓合并后只查询一次行情'''
+    user_ids = list(user_ids or _portfolio_states.keys() or [DEFAULT_USER_ID])
+    codes = set()
+    for user_id in user_ids:
+        codes.update(_get_portfolio_state(user_id)['positions'].keys())
+    prices = _get_latest_prices(codes, from_tool=False) if codes else {}
+    return [record_equity_snapshot(user_id, prices) for user_id in user_ids]
+
+
+_recorder_thread = None
+_recorder_stop = threading.Event()
+
+
+def start_equity_recorder(interval=300, user_ids=None):
+    '''后台定时盯市，盘中默认每5分钟一次'''
+    global _recorder_thread
+    if _recorder_thread and _recorder_thread.is_alive():
+        return
+    _recorder_stop.clear()
+
+    def _loop():
+        recorded = False
+        while not _recorder_stop.is_set():
+            # 休市期间市值不变，只在启动时和盘中记录
+            if not recorded or is_market_open():
+                try:
+                    record_all_snapshots(user_ids)
+                    recorded = True
+                except Exception as e:
+                    print(f"权益曲线记录失败: {e}", flush=True)
+                _recorder_stop.wait(interval)
+            else:
+                _recorder_stop.wait(min(seconds_until(next_open()), 600))
+
+    _recorder_thread = threading.Thread(target=_loop, name="equity-recorder", daemon=True)
+    _recorder_thread.start()
+
+
+def stop_equity_recorder():
+    _recorder_stop.set()
+
+
+def _max_drawdown(values):
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return 0.0
+    peak = np.maximum.accumulate(values)
+    return float(np.min(values / peak - 1))
+
+
+def equity_curve_stats(curve):
+    '''权益曲线统计：累计收益、最大回撤、按日年化波动率'''
+    if len(curve) < 2:
+        return None
+    df = pd.DataFrame(curve, columns=['time', 'total'])
+    df['time'] = pd.to_datetime(df['time'])
+    daily = df.set_index('time')['total'].resample('D').last().dropna()
+    daily_ret = daily.pct_change().dropna()
+    totals = df['total'].to_numpy(np.float64)
+    return {
+        'start': curve[0]['time'],
+        'end': curve[-1]['time'],
+        'snapshots': len(curve),
+        'total_return_pct': round((totals[-1] / totals[0] - 1) * 100, 2),
+        'max_drawdown_pct': round(_max_drawdown(totals) * 100, 2),
+        'volatility_annual_pct': round(float(daily_ret.std() * np.sqrt(TRADING_DAYS)) * 100, 2)
+        if len(daily_ret) > 1 else None,
+    }
+
+
+def position_risk(codes, shares, cash, window=60):
+    '''
+    基于本地日线矩阵向量化计算持仓风险
+
+    缺少历史的股票每个交易日最多回填一次（停牌、新上市的股票回填后仍可能不足），
+    之后只用已有的有效数据计算，不再重复下载。
+    '''
+    matrix = get_price_matrix()
+    window = max(1, min(window, matrix.max_days - 1))
+    close = matrix.history('close', codes, window + 1)
+    session = last_session_date().strftime('%Y-%m-%d')
+    missing = [c for c, row in zip(codes, close)
+               if np.isfinite(row).sum() < window + 1 and _backfill_attempts.get(c) != session]
+    if missing:
+        _backfill_attempts.update((c, session) for c in missing)
+        matrix.backfill(missing)
+        close = matrix.history('close', codes, window + 1)
+    if close.shape[1] < 2:
+        raise ValueError("本地日线历史不足，无法计算收益")
+    window = close.shape[1] - 1
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rets = close[:, 1:] / close[:, :-1] - 1
+    last_close = np.array([row[np.isfinite(row)][-1] if np.isfinite(row).any() else np.nan for row in close])
+
+    values = np.nan_to_num(last_close * np.asarray(shares, dtype=np.float64))
+    total = values.sum() + cash
+    weights = values / total if total > 0 else np.zeros(len(codes))
+
+    clean = np.nan_to_num(rets)
+    port_ret = weights @ clean
+    cov = np.atleast_2d(np.cov(clean)) if len(codes) > 1 else np.array([[np.var(clean[0], ddof=1)]])
+    port_var = float(weights @ cov @ weights)
+    risk_contrib = weights * (cov @ weights) / port_var if port_var > 0 else np.zeros(len(codes))
+    corr = pd.DataFrame(rets.T, columns=codes).corr()
+
+    period_ret = np.nanprod(1 + rets, axis=1) - 1
+    positions = []
+    for i, code in enumerate(codes):
+        positions.append({
+            'stock_code': code,
+            'weight_pct': round(float(weights[i]) * 100, 2),
+            'return_pct': round(float(period_ret[i]) * 100, 2),
+            'return_contribution_pct': round(float(weights[i] * period_ret[i]) * 100, 2),
+            'volatility_annual_pct': round(float(np.nanstd(rets[i], ddof=1) * np.sqrt(TRADING_DAYS)) * 100, 2),
+            'risk_contribution_pct': round(float(risk_contrib[i]) * 100, 2),
+        })
+
+    return {
+        'window': window,
+        'as_of': matrix.dates[-1] if matrix.dates else None,
+        'portfolio_return_pct': round(float(np.prod(1 + port_ret) - 1) * 100, 2),
+        'portfolio_volatility_annual_pct': round(float(np.sqrt(port_var * TRADING_DAYS)) * 100, 2),
+        'max_drawdown_pct': round(_max_drawdown(np.cumprod(1 + port_ret)) * 100, 2),
+        'positions': positions,
+        'correlation': corr.round(2).fillna(0).to_dict(),
+    }
+
+
+@tool
+def portfolio_risk(window: int = 60, runtime: ToolRuntime = None):
+    '''
+    组合风险分析：持仓在最近 window 个交易日的收益、最大回撤、波动率、各持仓的收益/风险贡献和相关性矩阵，
+    以及账户权益曲线的累计收益和回撤（数据来自本地缓存，无需重新下载行情）
+
+    参数:
+        window: 回看的交易日数，默认60，最多为本地保存的交易日数
+
+    返回:
+        包含组合风险指标、持仓贡献、相关性矩阵和权益曲线统计的字典
+    '''
+    print(f"组合风险分析: 窗口 {window}", flush=True)
+    user_id = _runtime_user_id(runtime)
+    state = _get_portfolio_state(user_id)
+    result = {
+        'cash': round(state['cash'], 2),
+        'equity_curve': equity_curve_stats(load_equity_curve(user_id)),
+    }
+    positions = state['positions']
+    if not positions:
+        result['holdings_risk'] = None
+        return result
+
+    try:
+        pos_arr = positions_to_array(positions)
+        result['holdings_risk'] = position_risk(pos_arr['code'].tolist(), pos_arr['shares'], state['cash'], window)
+    except Exception as e:
+        result['error'] = f"组合风险计算失败: {str(e)}"
+    return result
+
+
+risk_tools = [
+    portfolio_risk,
+]
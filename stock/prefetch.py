@@ -0,0 +1,69 @@
+"""
+投机预取 - 在调用 Agent 之前扫描用户消息中的股票名称和代码，提到股票时后台预热快照和日线缓存
+
+之后的 get_stock_code_by_name / analyze_stock_trend_detailed 等工具调用直接命中缓存，
+预取命中率见 market_cache.cache_stats()。
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from stock.market_cache import get_daily_history, get_name_index, get_spot_snapshot
+
+
+# 单条消息最多预取的股票数量
+MAX_PREFETCH_CODES = 5
+
+CODE_PATTERN = re.compile(r"(?<!\d)\d{6}(?!\d)")
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+
+
+def scan_stocks(message):
+    '''从消息中识别股票，返回 [(代码, 名称)]，按出现顺序去重'''
+    index = get_name_index()
+    code_to_name = index['codes']
+    found = []
+    for m in CODE_PATTERN.finditer(message):
+        if m.group(0) in code_to_name:
+            found.append((m.start(), m.group(0), code_to_name[m.group(0)]))
+    if index['pattern'] is not None:
+        for m in index['pattern'].finditer(message):
+            found.append((m.start(), index['names'][m.group(0)], m.group(0)))
+
+    result = []
+    seen = set()
+    for _, code, name in sorted(found):
+        if code not in seen:
+            seen.add(code)
+            result.append((code, name))
+    return result[:MAX_PREFETCH_CODES]
+
+
+def _prefetch_task(message):
+    try:
+        # 名称索引按天缓存，扫描不需要下载行情；消息里没有提到股票时不预热快照
+        stocks = scan_stocks(message)
+        if not stocks:
+            return stocks
+        print(f"🔮 预取: {', '.join(f'{name}({code})' for code, name in stocks)}", flush=True)
+        for code, _ in stocks:
+            _executor.submit(_prefetch_history, code)
+        # 快照被名称查询、现价查询共用
+        get_spot_snapshot(prefetch=True)
+        return stocks
+    except Exception as e:
+        print(f"预取失败: {e}", flush=True)
+        return []
+
+
+def _prefetch_history(code):
+    try:
+        # 参数与 analyze_stock_trend_detailed 保持一致，才能命中同一个缓存键
+        get_daily_history(code, days=60, adjust="qfq", prefetch=True)
+    except Exception as e:
+        print(f"预取日线失败: {code}, {e}", flush=True)
+
+
+def start_prefetch(message):
+    '''非阻塞地开始预取，返回 Future（结果为识别出的股票列表）'''
+    return _executor.submit(_prefetch_task, message)
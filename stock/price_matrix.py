@@ -0,0 +1,432 @@
+"""
+全市场价格矩阵 - 股票代码 × 交易日 的稠密矩阵（收盘价、成交量、换手率），以内存映射的 NumPy 文件保存
+
+每个交易日只需一次全市场快照即可追加一列，横截面排名（动量、相对市值加权大盘的强弱、波动率）一次向量化计算完成。
+首次使用前需要回填全市场历史：
+    uv run python -m stock.price_matrix --seed
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import akshare as ak
+import numpy as np
+import pandas as pd
+from langchain.tools import tool
+
+from stock.market_cache import get_spot_snapshot
+from stock.records import quotes_from_frame
+from stock import trading_calendar
+from stock.trading_calendar import last_session_date
+
+
+MATRIX_DIR = "data/price_matrix"
+# 保留的交易日数量（约一年），超出后丢弃最早的一列
+MAX_DAYS = 260
+# 矩阵字段 -> 行情结构化数组（records.QUOTE_DTYPE）字段
+FIELDS = {
+    'close': 'price',
+    'volume': 'volume',
+    'turnover': 'turnover',
+}
+# 历史日线对应的列名
+HIST_FIELDS = {
+    'close': '收盘',
+    'volume': '成交量',
+    'turnover': '换手率',
+}
+# 窗口内有效收盘价占比低于该值的股票不参与排名（停牌过久、新上市或未回填）
+MIN_ROW_COVERAGE = 0.8
+# 参与排名的股票占当日有行情股票的比例低于该值时拒绝给出“全市场”排名
+MIN_UNIVERSE_COVERAGE = 0.9
+# 回填时每批股票数量，每批写入一次文件（中断后已完成的批次不会丢失）
+BACKFILL_BATCH = 200
+
+
+class PriceMatrix:
+    '''代码 × 交易日矩阵存储，数组为 float32 memmap，缺失值为 NaN'''
+
+    def __init__(self, directory=MATRIX_DIR, max_days=MAX_DAYS):
+        self.directory = directory
+        self.max_days = max_days
+        self.codes = []
+        self.names = []
+        self.dates = []
+        self.backfilled = {}  # 代码 -> 最近一次回填日线时的交易日
+        self.arrays = {}
+        self.market_cap = None
+        self._index = {}
+        self._lock = threading.RLock()
+        self._load()
+
+    # ---- 文件读写 ----
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}.npy")
+
+    def _load(self):
+        meta_file = os.path.join(self.directory, "meta.json")
+        if not os.path.exists(meta_file):
+            return
+        with open(meta_file, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.codes = meta["codes"]
+        self.names = meta["names"]
+        self.dates = meta["dates"]
+        self.backfilled = meta.get("backfilled", {})
+        self.max_days = meta.get("max_days", self.max_days)
+        self._index = {code: i for i, code in enumerate(self.codes)}
+        for field in FIELDS:
+            self.arrays[field] = np.load(self._path(field), mmap_mode='r+')
+        self.market_cap = np.load(self._path('market_cap'), mmap_mode='r+')
+
+    def _save_meta(self):
+        with open(os.path.join(self.directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "codes": self.codes,
+                "names": self.names,
+                "dates": self.dates,
+                "backfilled": self.backfilled,
+                "max_days": self.max_days,
+            }, f, ensure_ascii=False)
+
+    def flush(self):
+        for arr in self.arrays.values():
+            arr.flush()
+        if self.market_cap is not None:
+            self.market_cap.flush()
+        self._save_meta()
+
+    def _allocate(self, n_codes):
+        '''按新的股票数量重新分配文件，保留已有数据（只在新股上市等少数情况下发生）'''
+        os.makedirs(self.directory, exist_ok=True)
+        # 已有数据的行数以现有数组为准（调用时 self.codes 可能还没有更新）
+        old_n = self.market_cap.shape[0] if self.market_cap is not None else 0
+        for field in FIELDS:
+            new = np.lib.format.open_memmap(self._path(field) + ".tmp", mode='w+', dtype=np.float32,
+                                            shape=(n_codes, self.max_days))
+            new[:] = np.nan
+            if field in self.arrays:
+                new[:old_n] = self.arrays[field]
+            new.flush()
+            del new
+            self.arrays.pop(field, None)
+            os.replace(self._path(field) + ".tmp", self._path(field))
+            self.arrays[field] = np.load(self._path(field), mmap_mode='r+')
+
+        new_cap = np.lib.format.open_memmap(self._path('market_cap') + ".tmp", mode='w+', dtype=np.float64,
+                                            shape=(n_codes,))
+        new_cap[:] = np.nan
+        if self.market_cap is not None:
+            new_cap[:old_n] = self.market_cap
+        new_cap.flush()
+        del new_cap
+        self.market_cap = None
+        os.replace(self._path('market_cap') + ".tmp", self._path('market_cap'))
+        self.market_cap = np.load(self._path('market_cap'), mmap_mode='r+')
+
+    def _ensure_codes(self, codes, names):
+        new = list({c: n for c, n in zip(codes, names) if c not in self._index}.items())
+        if not new and self.arrays:
+            return
+        # 先扩容，成功后再登记新代码，避免扩容失败时 codes/_index 与数组行数不一致
+        self._allocate(len(self.codes) + len(new))
+        for code, name in new:
+            self._index[code] = len(self.codes)
+            self.codes.append(code)
+            self.names.append(name)
+
+    def _column_for(self, date):
+        '''返回日期对应的列号，新日期追加在末尾，满了则整体左移一列'''
+        if date in self.dates:
+            return self.dates.index(date)
+        if self.dates and date < self.dates[-1]:
+            raise ValueError(f"只能按时间顺序追加日期: {date} < {self.dates[-1]}")
+        if len(self.dates) >= self.max_days:
+            for arr in self.arrays.values():
+                arr[:, :-1] = arr[:, 1:]
+                arr[:, -1] = np.nan
+            self.dates.pop(0)
+        self.dates.append(date)
+        return len(self.dates) - 1
+
+    # ---- 增量更新 ----
+    def update_from_spot(self, spot_df, date=None):
+        '''用一次全市场快照写入当日一列'''
+        date = date or trading_calendar.now().strftime('%Y-%m-%d')
+        spot_df = spot_df.dropna(subset=['最新价'])
+        spot_df = spot_df[spot_df['最新价'] > 0]
+        with self._lock:
+            self._ensure_codes(spot_df['代码'].tolist(), spot_df['名称'].tolist())
+            col = self._column_for(date)
+            quotes = quotes_from_frame(spot_df)
+            rows = np.fromiter((self._index[c] for c in quotes['code']), dtype=np.int64, count=len(quotes))
+            for field, quote_field in FIELDS.items():
+                self.arrays[field][rows, col] = quotes[quote_field]
+            self.market_cap[rows] = quotes['market_cap']
+            self.flush()
+
+    def backfill(self, codes, days=MAX_DAYS, workers=8):
+        '''并行拉取日线回填历史（首次建库时使用，较慢）'''
+        end = trading_calendar.now()
+        start = (end - timedelta(days=int(days * 1.5))).strftime('%Y%m%d')
+
+        def _fetch(code):
+            try:
+                return code, ak.stock_zh_a_hist(symbol=code, period="daily", start_date=start,
+                                                end_date=end.strftime('%Y%m%d'), adjust="qfq")
+            except Exception as e:
+                print(f"回填失败: {code}, {e}", flush=True)
+                return code, None
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            frames = {code: df for code, df in pool.map(_fetch, codes) if df is not None}
+        if not frames:
+            return 0
+        session = last_session_date().strftime('%Y-%m-%d')
+        with self._lock:
+            all_dates = {str(d) for df in frames.values() for d in df['日期']}
+            all_dates = sorted(all_dates | set(self.dates))[-self.max_days:]
+            self._ensure_codes(list(frames), [self.names[self._index[c]] if c in self._index else c for c in frames])
+            # 重新按合并后的日期排布所有列
+            date_pos = {d: i for i, d in enumerate(all_dates)}
+            for field in FIELDS:
+                arr = self.arrays[field]
+                old = np.array(arr)
+                arr[:] = np.nan
+                for i, d in enumerate(self.dates):
+                    if d in date_pos:
+                        arr[:, date_pos[d]] = old[:, i]
+            self.dates = all_dates
+            for code, df in frames.items():
+                row = self._index[code]
+                cols = np.array([date_pos.get(str(d), -1) for d in df['日期']])
+                mask = cols >= 0
+                for field, column in HIST_FIELDS.items():
+                    self.arrays[field][row, cols[mask]] = df[column].to_numpy(np.float32)[mask]
+                self.backfilled[code] = session
+            self.flush()
+        return len(frames)
+
+    # ---- 横截面计算 ----
+    def window(self, field, days):
+        '''最近 days 个交易日的矩阵视图'''
+        n = len(self.dates)
+        return self.arrays[field][:len(self.codes), max(0, n - days):n]
+
+    def history(self, field, codes, days):
+        '''指定股票最近 days 个交易日的数据，形状 (len(codes), days)，不在矩阵中的股票整行为 NaN'''
+        with self._lock:
+            n = len(self.dates)
+            out = np.full((len(codes), min(days, n)), np.nan)
+            rows = [(i, self._index[c]) for i, c in enumerate(codes) if c in self._index]
+            if rows and n:
+                dst, src = zip(*rows)
+                out[list(dst)] = self.arrays[field][list(src), max(0, n - days):n]
+            return out
+
+    def rank(self, metric='momentum', window=20, min_market_cap=None):
+        '''
+        一次向量化计算全市场排名，返回按指标降序的 DataFrame
+
+        只有窗口内有效收盘价足够的股票参与排名；参与排名的股票占当日有行情股票的比例不足
+        MIN_UNIVERSE_COVERAGE 时抛出 ValueError。覆盖情况记录在 DataFrame.attrs 中：
+        universe（当日有行情的股票数）、covered（历史足够的股票数）、ranked（实际排名的股票数）。
+        '''
+        with self._lock:
+            if len(self.dates) < window + 1:
+                raise ValueError(f"历史数据不足: 需要 {window + 1} 个交易日，当前 {len(self.dates)} 个，"
+                                 f"请先运行 python -m stock.price_matrix --seed 回填全市场历史")
+            close = np.asarray(self.window('close', window + 1), dtype=np.float64)
+            names = np.array(self.names)
+            codes = np.array(self.codes)
+            cap = np.asarray(self.market_cap[:len(self.codes)])
+
+        finite = np.isfinite(close)
+        active = finite[:, -1]
+        covered = active & (finite.mean(axis=1) >= MIN_ROW_COVERAGE)
+        n_active, n_covered = int(active.sum()), int(covered.sum())
+        if n_active == 0 or n_covered < n_active * MIN_UNIVERSE_COVERAGE:
+            raise ValueError(f"历史覆盖不足: 最近 {window + 1} 个交易日内只有 {n_covered}/{n_active} 只股票有足够数据，"
+                             f"排名不能代表全市场，请先运行 python -m stock.price_matrix --seed 回填全市场历史")
+
+        # 窗口起点取每只股票第一个有效收盘价（窗口开头停牌的股票不被丢弃）
+        first = close[np.arange(len(close)), np.argmax(finite, axis=1)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            momentum = close[:, -1] / first - 1
+            log_ret = np.diff(np.log(close), axis=1)
+            volatility = np.nanstd(log_ret, axis=1) * np.sqrt(252)
+
+        valid = covered & np.isfinite(momentum)
+        if min_market_cap is not None:
+            valid &= cap >= min_market_cap
+
+        # 基准：以总市值加权的全市场（覆盖样本）日对数收益序列
+        weights = np.where(covered & np.isfinite(cap), cap, 0.0)[:, None] * np.isfinite(log_ret)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            market_ret = np.nansum(weights * np.nan_to_num(log_ret), axis=0) / weights.sum(axis=0)
+            excess = log_ret - market_ret
+            # 信息比率：日超额收益均值 / 跟踪误差（年化），同样的区间涨幅下走势越稳定越靠前
+            info_ratio = np.nanmean(excess, axis=1) / np.nanstd(excess, axis=1, ddof=1) * np.sqrt(252)
+
+        if metric == 'momentum':
+            value = momentum
+        elif metric == 'relative_strength':
+            value = info_ratio
+            valid &= np.isfinite(info_ratio)
+        elif metric == 'volatility':
+            value = volatility
+            valid &= np.isfinite(volatility)
+        else:
+            raise ValueError(f"不支持的指标: {metric}")
+
+        idx = np.nonzero(valid)[0]
+        order = idx[np.argsort(-value[idx], kind='stable')]
+        pct = np.empty(len(order))
+        pct[:] = 100.0 * (1 - np.arange(len(order)) / max(len(order), 1))
+        table = pd.DataFrame({
+            'code': codes[order],
+            'name': names[order],
+            'value': value[order],
+            'momentum': momentum[order],
+            'volatility': volatility[order],
+            'percentile': pct,
+            'market_cap': cap[order],
+        })
+        table.attrs.update(universe=n_active, covered=n_covered, ranked=len(order),
+                           benchmark_return=float(np.expm1(np.nansum(market_ret))))
+        return table
+
+    def uncovered_codes(self, min_days=None):
+        '''有效收盘价少于 min_days（默认为已有日期数的 MIN_ROW_COVERAGE）且从未回填过的股票'''
+        with self._lock:
+            n = len(self.dates)
+            if not n:
+                return list(self.codes)
+            min_days = min_days or int(n * MIN_ROW_COVERAGE)
+            counts = np.isfinite(self.arrays['close'][:len(self.codes), :n]).sum(axis=1)
+            return [c for c, k in zip(self.codes, counts) if k < min_days and c not in self.backfilled]
+
+
+_matrix = None
+_matrix_lock = threading.Lock()
+_applied_spot = None  # (快照, 日期)：最近一次写入矩阵的快照，同一份快照不重复写入
+
+
+def get_price_matrix():
+    global _matrix
+    with _matrix_lock:
+        if _matrix is None:
+            _matrix = PriceMatrix()
+        return _matrix
+
+
+def update_price_matrix(spot_df=None, date=None, from_tool=False):
+    '''
+    用全市场快照（默认取 market_cache 中的快照）写入最近一个交易日的一列（开盘前的快照仍是上一交易日的收盘数据）。
+    同一份快照已经写入过时直接返回 False。
+    '''
+    global _applied_spot
+    date = date or last_session_date().strftime('%Y-%m-%d')
+    if spot_df is None:
+        spot_df = get_spot_snapshot(from_tool=from_tool)
+    if _applied_spot is not None and _applied_spot[0] is spot_df and _applied_spot[1] == date:
+        return False
+    get_price_matrix().update_from_spot(spot_df, date)
+    _applied_spot = (spot_df, date)
+    return True
+
+
+def seed_price_matrix(days=MAX_DAYS, workers=8, spot_df=None):
+    '''以全市场快照的股票为范围，分批回填尚未回填过的股票日线，返回回填成功的股票数'''
+    update_price_matrix(spot_df=spot_df)
+    matrix = get_price_matrix()
+    codes = matrix.uncovered_codes(min_days=days)
+    print(f"全市场回填: {len(codes)} 只股票待回填", flush=True)
+    done = 0
+    for i in range(0, len(codes), BACKFILL_BATCH):
+        done += matrix.backfill(codes[i:i + BACKFILL_BATCH], days=days, workers=workers)
+        print(f"全市场回填: {min(i + BACKFILL_BATCH, len(codes))}/{len(codes)}", flush=True)
+    return done
+
+
+@tool
+def rank_stocks(metric: str = "momentum", window: int = 20, top_n: int = 20, min_market_cap_yi: float | None = None, ascending: bool = False):
+    '''
+    全市场横截面排名，例如“大盘股中20日相对强度最强的股票”
+
+    参数:
+        metric: 排名指标，"momentum"（区间涨幅）、"relative_strength"（相对市值加权全市场的信息比率：日超额收益均值/跟踪误差，年化）、"volatility"（年化波动率）
+        window: 计算窗口（交易日数），默认20
+        top_n: 返回数量，默认20
+        min_market_cap_yi: 最小总市值（亿元），例如 500 表示只看市值500亿以上的大盘股
+        ascending: 为 True 时返回排名最低的股票（例如最弱或波动最小）
+
+    返回:
+        排名列表，每项包含代码、名称、指标值、区间涨幅、波动率和百分位；universe 为当日有行情的股票数，
+        ranked 为实际参与排名的股票数。本地历史覆盖不足以代表全市场时返回 error
+    '''
+    print(f"横截面排名: {metric}, 窗口: {window}", flush=True)
+    try:
+        matrix = get_price_matrix()
+        # 盘中当天的一列随快照更新（快照在缓存有效期内复用，不会每次都重新下载）
+        if (not matrix.dates or matrix.dates[-1] != last_session_date().strftime('%Y-%m-%d')
+                or trading_calendar.is_market_open()):
+            update_price_matrix(from_tool=True)
+
+        min_cap = min_market_cap_yi * 1e8 if min_market_cap_yi is not None else None
+        ranked = matrix.rank(metric, window, min_cap)
+        table = (ranked.iloc[::-1] if ascending else ranked).head(top_n)
+
+        return {
+            'metric': metric,
+            'window': window,
+            'as_of': matrix.dates[-1],
+            'universe': ranked.attrs['universe'],
+            'ranked': ranked.attrs['ranked'],
+            'market_return_pct': round(ranked.attrs['benchmark_return'] * 100, 2),
+            'stocks': [
+                {
+                    'code': row.code,
+                    'name': row.name,
+                    'value': round(float(row.value) * (100 if metric == 'momentum' else 1), 2),
+                    'momentum_pct': round(float(row.momentum) * 100, 2),
+                    'volatility': round(float(row.volatility), 3),
+                    'percentile': round(float(row.percentile), 1),
+                    'market_cap_yi': round(float(row.market_cap) / 1e8, 1) if np.isfinite(row.market_cap) else None,
+                }
+                for row in table.itertuples(index=False)
+            ],
+        }
+    except Exception as e:
+        return {'error': f"横截面排名失败: {str(e)}"}
+
+
+matrix_tools = [
+    rank_stocks,
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="全市场价格矩阵维护")
+    parser.add_argument("--seed", action="store_true", help="回填全市场日线历史（首次使用前运行，约需数分钟）")
+    parser.add_argument("--days", type=int, default=MAX_DAYS, help="回填的交易日数")
+    parser.add_argument("-w", "--workers", type=int, default=8, help="并行下载数")
+    args = parser.parse_args(argv)
+
+    if args.seed:
+        done = seed_price_matrix(days=args.days, workers=args.workers)
+        print(f"🏁 回填完成: {done} 只股票")
+    else:
+        update_price_matrix()
+    matrix = get_price_matrix()
+    print(f"价格矩阵: {len(matrix.codes)} 只股票, {len(matrix.dates)} 个交易日"
+          f"（{matrix.dates[0] if matrix.dates else '-'} ~ {matrix.dates[-1] if matrix.dates else '-'}）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
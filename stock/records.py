@@ -0,0 +1,160 @@
+"""
+紧凑数据结构 - 持仓、成交的 slots 数据类，以及持仓/行情批量计算用的 NumPy 结构化数组
+
+持仓文件的 JSON 格式不变，Position.to_dict / from_dict 负责与持久化层互转。
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from stock import trading_calendar
+
+
+@dataclass(slots=True)
+class Position:
+    """单只股票的持仓"""
+    code: str
+    name: str = ''
+    shares: int = 0
+    avg_cost: float = 0.0
+    stop_loss_pct: float | None = None
+    take_profit_pct: float | None = None
+
+    @classmethod
+    def from_dict(cls, code, data):
+        return cls(
+            code=str(code),
+            name=data.get('name', '') or '',
+            shares=int(data.get('shares', 0)),
+            avg_cost=float(data.get('avg_cost', 0.0)),
+            stop_loss_pct=data.get('stop_loss_pct'),
+            take_profit_pct=data.get('take_profit_pct'),
+        )
+
+    def to_dict(self):
+        # 与 data/portfolio_state.json 中的持仓格式一致（代码作为外层键）
+        return {
+            'name': self.name,
+            'shares': self.shares,
+            'avg_cost': self.avg_cost,
+            'stop_loss_pct': self.stop_loss_pct,
+            'take_profit_pct': self.take_profit_pct,
+        }
+
+    @property
+    def stop_loss_price(self):
+        if self.stop_loss_pct is None:
+            return None
+        return round(self.avg_cost * (1 - self.stop_loss_pct / 100), 2)
+
+    @property
+    def take_profit_price(self):
+        if self.take_profit_pct is None:
+            return None
+        return round(self.avg_cost * (1 + self.take_profit_pct / 100), 2)
+
+
+@dataclass(slots=True)
+class Trade:
+    """一笔虚拟成交"""
+    action: str
+    code: str
+    price: float
+    shares: int
+    amount: float
+    realized_profit: float | None = None
+    time: str = ''
+
+    @classmethod
+    def from_tool_result(cls, result):
+        '''由 buy_stock / sell_stock 的返回结果构建，失败的调用返回 None'''
+        if not isinstance(result, dict) or 'action' not in result:
+            return None
+        return cls(
+            action=result['action'],
+            code=result['stock_code'],
+            price=result['price'],
+            shares=result['shares'],
+            amount=result.get('cost', result.get('proceeds', 0.0)),
+            realized_profit=result.get('realized_profit'),
+            time=result.get('time') or trading_calendar.now().strftime('%Y-%m-%d %H:%M:%S'),
+        )
+
+    def to_dict(self):
+        return {
+            'action': self.action,
+            'stock_code': self.code,
+            'price': self.price,
+            'shares': self.shares,
+            'amount': self.amount,
+            'realized_profit': self.realized_profit,
+            'time': self.time,
+        }
+
+
+# ====== 批量数组形式 ======
+
+POSITION_DTYPE = np.dtype([
+    ('code', 'U6'),
+    ('shares', np.int64),
+    ('avg_cost', np.float64),
+    ('stop_loss_pct', np.float32),    # 未设置为 NaN
+    ('take_profit_pct', np.float32),  # 未设置为 NaN
+])
+
+QUOTE_DTYPE = np.dtype([
+    ('code', 'U6'),
+    ('price', np.float32),
+    ('volume', np.float32),
+    ('change_pct', np.float32),
+    ('volume_ratio', np.float32),
+    ('turnover', np.float32),
+    ('market_cap', np.float64),
+])
+
+# 行情快照列 -> QUOTE_DTYPE 字段
+QUOTE_COLUMNS = {
+    'price': '最新价',
+    'volume': '成交量',
+    'change_pct': '涨跌幅',
+    'volume_ratio': '量比',
+    'turnover': '换手率',
+    'market_cap': '总市值',
+}
+
+
+def positions_to_array(positions):
+    '''{代码: Position} -> 结构化数组'''
+    arr = np.empty(len(positions), dtype=POSITION_DTYPE)
+    for i, pos in enumerate(positions.values()):
+        arr[i] = (
+            pos.code,
+            pos.shares,
+            pos.avg_cost,
+            np.nan if pos.stop_loss_pct is None else pos.stop_loss_pct,
+            np.nan if pos.take_profit_pct is None else pos.take_profit_pct,
+        )
+    return arr
+
+
+def quotes_from_frame(spot_df):
+    '''行情快照 DataFrame -> 结构化数组（按列整体转换，不逐行 to_dict）'''
+    arr = np.empty(len(spot_df), dtype=QUOTE_DTYPE)
+    arr['code'] = spot_df['代码'].astype(str).to_numpy()
+    for field, column in QUOTE_COLUMNS.items():
+        arr[field] = pd.to_numeric(spot_df[column], errors='coerce').to_numpy()
+    return arr
+
+
+def value_positions(pos_arr, prices):
+    '''
+    批量估值：prices 为 {代码: 价格}，缺少价格的持仓市值为 NaN
+
+    返回 (最新价, 市值, 浮动盈亏比例) 三个与 pos_arr 等长的数组
+    '''
+    price = np.fromiter((prices.get(code, np.nan) for code in pos_arr['code']), dtype=np.float64, count=len(pos_arr))
+    market_value = price * pos_arr['shares']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pnl_pct = price / pos_arr['avg_cost'] - 1
+    return price, market_value, pnl_pct
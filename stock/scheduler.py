@@ -0,0 +1,113 @@
+"""
+定时任务 - 按交易日历在盘前批量刷新基础数据，盘中按交易时段刷新行情
+
+- 盘前（交易日 PRE_OPEN_TIME）：股票名称索引、上一交易日收盘写入价格矩阵、行业和概念板块映射
+- 盘中（每 INTRADAY_INTERVAL 秒，仅连续竞价时段）：全市场快照缓存、自选股比较
+- 收盘后（POST_CLOSE_TIME）：当日收盘写入价格矩阵，并回填尚未回填过历史的股票（首次运行即全市场回填）
+"""
+import threading
+from datetime import datetime, time, timedelta
+
+from stock import trading_calendar
+from stock.market_cache import get_name_index, get_spot_snapshot
+from stock.price_matrix import seed_price_matrix, update_price_matrix
+from stock.sector_tools import get_sector_mapping
+from stock.watchlist import watchlist_monitor
+
+
+PRE_OPEN_TIME = time(9, 0)
+POST_CLOSE_TIME = time(15, 5)
+INTRADAY_INTERVAL = 30
+
+
+def pre_open_refresh():
+    '''盘前批量刷新：名称索引、价格矩阵（上一交易日收盘）、行业和概念板块映射'''
+    print("⏰ 盘前刷新开始", flush=True)
+    for name, job in (
+        ("股票名称索引", lambda: get_name_index(force_refresh=True)),
+        ("价格矩阵", lambda: update_price_matrix(spot_df=get_spot_snapshot())),
+        ("行业板块映射", lambda: get_sector_mapping('industry', force_refresh=True)),
+        ("概念板块映射", lambda: get_sector_mapping('concept', force_refresh=True)),
+    ):
+        try:
+            job()
+        except Exception as e:
+            print(f"盘前刷新失败: {name}, {e}", flush=True)
+    print("⏰ 盘前刷新完成", flush=True)
+
+
+def intraday_refresh():
+    '''盘中刷新：更新快照缓存，并用同一份快照做自选股比较'''
+    spot_df = get_spot_snapshot(max_age=0)
+    if watchlist_monitor.codes:
+        watchlist_monitor.refresh(spot_df)
+
+
+def post_close_refresh():
+    '''收盘后把当日收盘数据写入价格矩阵，并回填新出现的股票的历史'''
+    try:
+        # 强制重新拉取：缓存里可能是收盘前的快照，休市期间它会一直被当作有效
+        seed_price_matrix(spot_df=get_spot_snapshot(max_age=0))
+    except Exception as e:
+        print(f"收盘后刷新失败: {e}", flush=True)
+
+
+def _next_daily(at, after):
+    '''after 之后下一个交易日的 at 时刻'''
+    day = after.date()
+    for offset in range(0, 60):
+        d = day + timedelta(days=offset)
+        candidate = datetime.combine(d, at)
+        if candidate > after and trading_calendar.is_trading_day(d):
+            return candidate
+    raise ValueError("60天内没有交易日")
+
+
+class MarketScheduler:
+    '''单线程调度：每轮计算最近的任务时刻并等待'''
+
+    def __init__(self, intraday_interval=INTRADAY_INTERVAL):
+        self.intraday_interval = intraday_interval
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _next_jobs(self, now):
+        jobs = [
+            (_next_daily(PRE_OPEN_TIME, now), pre_open_refresh),
+            (_next_daily(POST_CLOSE_TIME, now), post_close_refresh),
+        ]
+        if trading_calendar.is_market_open(now):
+            jobs.append((now + timedelta(seconds=self.intraday_interval), intraday_refresh))
+        else:
+            jobs.append((trading_calendar.next_open(now), intraday_refresh))
+        return sorted(jobs, key=lambda job: job[0])
+
+    def _loop(self):
+        while not self._stop.is_set():
+            now = trading_calendar.now()
+            when, job = self._next_jobs(now)[0]
+            if self._stop.wait(trading_calendar.seconds_until(when)):
+                break
+            try:
+                job()
+            except Exception as e:
+                print(f"定时任务失败: {job.__name__}, {e}", flush=True)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        # 盘中自选股比较由调度器统一驱动，与快照刷新共用一次下载
+        watchlist_monitor.use_external_driver()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="market-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+market_scheduler = MarketScheduler()
+
+
+def start_scheduler():
+    market_scheduler.start()
@@ -0,0 +1,217 @@
+"""
+板块分析 - 缓存股票代码到行业/概念的映射（每日刷新），在行情快照上用 groupby 计算板块聚合指标
+
+映射由调度器在盘前预热；下载不完整时不写入当天的缓存，继续使用上一次完整的映射。
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import akshare as ak
+import numpy as np
+import pandas as pd
+from langchain.tools import tool
+
+from stock import trading_calendar
+from stock.market_cache import get_spot_snapshot
+
+
+SECTOR_CACHE_DIR = "data/sector_mapping"
+# 成分股下载成功的板块占比低于该值时视为下载失败，不保存
+MIN_BOARD_SUCCESS = 0.9
+# 下载失败后，间隔多少秒再重试（期间使用上一次完整的映射）
+MAPPING_RETRY_SECONDS = 1800
+DOWNLOAD_WORKERS = 8
+
+# 板块类型 -> (板块列表接口, 成分股接口)
+SECTOR_SOURCES = {
+    'industry': (ak.stock_board_industry_name_em, ak.stock_board_industry_cons_em),
+    'concept': (ak.stock_board_concept_name_em, ak.stock_board_concept_cons_em),
+}
+
+SORT_COLUMNS = {
+    'return': 'cap_weighted_return',
+    'breadth': 'breadth',
+    'turnover': 'amount',
+}
+
+_mapping_cache = {}  # kind -> (日期, DataFrame[代码, sector])
+_last_failure = {}  # kind -> 上次下载失败的 time.monotonic()
+_mapping_lock = threading.Lock()
+
+
+def _cache_file(kind):
+    return os.path.join(SECTOR_CACHE_DIR, f"{kind}.json")
+
+
+def _download_mapping(kind):
+    '''
+    并行拉取各板块成分股，构建 代码 -> 板块 映射（概念板块为多对多）
+
+    成功的板块占比低于 MIN_BOARD_SUCCESS 时抛出 RuntimeError，不返回不完整的映射。
+    '''
+    list_func, cons_func = SECTOR_SOURCES[kind]
+    boards = list_func()['板块名称'].tolist()
+    if not boards:
+        raise RuntimeError(f"板块列表为空: {kind}")
+
+    def _fetch(board):
+        try:
+            return board, cons_func(symbol=board)
+        except Exception as e:
+            print(f"获取板块成分股失败: {board}, {e}", flush=True)
+            return board, None
+
+    rows = []
+    ok = 0
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+        for board, cons in pool.map(_fetch, boards):
+            if cons is None:
+                continue
+            ok += 1
+            rows.extend((code, board) for code in cons['代码'].astype(str))
+    if ok < len(boards) * MIN_BOARD_SUCCESS:
+        raise RuntimeError(f"板块成分股下载不完整: 成功 {ok}/{len(boards)} 个板块")
+    return pd.DataFrame(rows, columns=['代码', 'sector'])
+
+
+def _read_cache_file(kind):
+    '''读取上一次完整下载的映射文件，返回 (日期, DataFrame)，没有文件时返回 (None, None)'''
+    try:
+        with open(_cache_file(kind), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data.get("date"), pd.DataFrame(data["rows"], columns=['代码', 'sector'])
+    except Exception:
+        return None, None
+
+
+def get_sector_mapping(kind='industry', force_refresh=False):
+    '''
+    获取板块映射：优先使用内存缓存，其次当天的文件缓存，否则重新下载
+
+    下载失败（板块列表失败或多数板块失败）时退回上一次完整的映射文件，并在 MAPPING_RETRY_SECONDS 内不再重试；
+    没有可用的旧映射时抛出异常。返回的 DataFrame.attrs['date'] 为映射日期。
+    '''
+    if kind not in SECTOR_SOURCES:
+        raise ValueError(f"不支持的板块类型: {kind}")
+    today = trading_calendar.now().strftime('%Y-%m-%d')
+
+    with _mapping_lock:
+        cached = _mapping_cache.get(kind)
+        if cached and not force_refresh:
+            failed_at = _last_failure.get(kind)
+            if cached[0] == today or (failed_at and time.monotonic() - failed_at < MAPPING_RETRY_SECONDS):
+                return cached[1]
+
+        file_date, file_mapping = _read_cache_file(kind)
+        if file_date == today and not force_refresh:
+            mapping, date = file_mapping, today
+        else:
+            print(f"刷新板块映射: {kind}", flush=True)
+            try:
+                mapping, date = _download_mapping(kind), today
+                _last_failure.pop(kind, None)
+                try:
+                    os.makedirs(SECTOR_CACHE_DIR, exist_ok=True)
+                    with open(_cache_file(kind), "w", encoding="utf-8") as f:
+                        json.dump({"date": today, "rows": mapping.values.tolist()}, f, ensure_ascii=False)
+                except Exception:
+                    # 缓存写入失败不影响分析
+                    pass
+            except Exception as e:
+                _last_failure[kind] = time.monotonic()
+                if cached:
+                    file_date, file_mapping = cached
+                if file_mapping is None:
+                    raise
+                print(f"板块映射下载失败，使用 {file_date} 的映射: {e}", flush=True)
+                mapping, date = file_mapping, file_date
+
+        mapping.attrs['date'] = date
+        _mapping_cache[kind] = (date, mapping)
+        return mapping
+
+
+def aggregate_sectors(spot_df, mapping, leaders=3):
+    '''在行情快照上按板块聚合：市值加权涨跌幅、上涨家数占比、成交额、平均换手率和领涨股'''
+    df = spot_df[['代码', '名称', '涨跌幅', '总市值', '成交额', '换手率']].merge(mapping, on='代码', how='inner')
+    for col in ['涨跌幅', '总市值', '成交额', '换手率']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df = df.dropna(subset=['涨跌幅', '总市值'])
+    df['weighted'] = df['涨跌幅'] * df['总市值']
+    df['up'] = (df['涨跌幅'] > 0).astype(np.int8)
+
+    grouped = df.groupby('sector')
+    result = grouped.agg(
+        count=('代码', 'size'),
+        weighted=('weighted', 'sum'),
+        market_cap=('总市值', 'sum'),
+        up=('up', 'sum'),
+        amount=('成交额', 'sum'),
+        avg_turnover=('换手率', 'mean'),
+        avg_return=('涨跌幅', 'mean'),
+    )
+    result['cap_weighted_return'] = result['weighted'] / result['market_cap']
+    result['breadth'] = result['up'] / result['count']
+
+    # 每个板块涨幅最大的几只股票
+    top = df.sort_values('涨跌幅', ascending=False).groupby('sector').head(leaders)
+    top_label = top['名称'] + '(' + top['涨跌幅'].round(2).astype(str) + '%)'
+    result['leaders'] = top_label.groupby(top['sector']).agg('、'.join)
+
+    return result.drop(columns=['weighted', 'up'])
+
+
+@tool
+def analyze_sectors(kind: str = "industry", sort_by: str = "return", top_n: int = 10, ascending: bool = False):
+    '''
+    板块强弱排行，回答“什么板块适合投资”一类问题
+
+    参数:
+        kind: 板块类型，"industry"（行业）或 "concept"（概念），默认"industry"
+        sort_by: 排序依据，"return"（市值加权涨跌幅）、"breadth"（上涨家数占比）、"turnover"（成交额），默认"return"
+        top_n: 返回板块数量，默认10
+        ascending: 为 True 时返回最弱的板块
+
+    返回:
+        板块排行列表，每项包含加权涨跌幅、上涨占比、成交额（亿元）、平均换手率和领涨股；
+        mapping_date 为板块成分映射的日期（早于今天说明使用的是上一次的映射）
+    '''
+    print(f"板块分析: {kind}, 排序: {sort_by}", flush=True)
+    if sort_by not in SORT_COLUMNS:
+        return {'error': f"sort_by 只能是 {list(SORT_COLUMNS)}"}
+    try:
+        mapping = get_sector_mapping(kind)
+        spot_df = get_spot_snapshot(from_tool=True)
+        table = aggregate_sectors(spot_df, mapping)
+        table = table.sort_values(SORT_COLUMNS[sort_by], ascending=ascending).head(top_n)
+
+        sectors = []
+        for rank, (sector, row) in enumerate(table.iterrows(), start=1):
+            sectors.append({
+                'rank': rank,
+                'sector': sector,
+                'count': int(row['count']),
+                'cap_weighted_return': round(float(row['cap_weighted_return']), 2),
+                'avg_return': round(float(row['avg_return']), 2),
+                'breadth': f"{round(float(row['breadth']) * 100, 1)}%",
+                'amount_yi': round(float(row['amount']) / 1e8, 2),
+                'avg_turnover': round(float(row['avg_turnover']), 2),
+                'leaders': row['leaders'],
+            })
+        return {
+            'kind': kind,
+            'sort_by': sort_by,
+            'update_time': trading_calendar.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'mapping_date': mapping.attrs.get('date'),
+            'sectors': sectors,
+        }
+    except Exception as e:
+        return {'error': f"板块分析失败: {str(e)}"}
+
+
+sector_tools = [
+    analyze_sectors,
+]
@@ -1,10 +1,15 @@
-import akshare as ak
 import json
-from datetime import datetime, timedelta
+import os
+import re
+import threading
+from datetime import datetime
 import numpy as np
 import pandas as pd
-from langchain.tools import tool
+from langchain.tools import tool, ToolRuntime
 from dataclasses import dataclass
+from stock import trading_calendar
+from stock.market_cache import get_spot_snapshot, get_daily_history
+from stock.records import Position, positions_to_array, value_positions
 
 
 @dataclass
@@ -28,7 +33,7 @@ def get_stock_code_by_name(stock_name: str):
     print(f"查询股票名称: {stock_name}", flush=True)
     try:
         # 获取所有A股实时数据
-        realtime_df = ak.stock_zh_a_spot_em()
+        realtime_df = get_spot_snapshot(from_tool=True)
         
         # 模糊匹配股票名称
         matched_stocks = realtime_df[realtime_df['名称'].str.contains(stock_name, na=False)]
@@ -36,15 +41,13 @@ def get_stock_code_by_name(stock_name: str):
         if len(matched_stocks) == 0:
             return {"error": f"未找到股票名称包含'{stock_name}'的股票"}
         
-        # 返回匹配结果
-        results = []
-        for _, row in matched_stocks.iterrows():
-            results.append({
-                "stock_code": row['代码'],
-                "stock_name": row['名称'],
-                "current_price": row['最新价'],
-                "change_pct": row['涨跌幅']
-            })
+        # 返回匹配结果（按列整体转换，不逐行构造）
+        results = matched_stocks[['代码', '名称', '最新价', '涨跌幅']].rename(columns={
+            '代码': "stock_code",
+            '名称': "stock_name",
+            '最新价': "current_price",
+            '涨跌幅': "change_pct",
+        }).to_dict('records')
         
         return {
             "query_name": stock_name,
@@ -65,7 +68,7 @@ def get_valid_stock_data(stock_codes):
     }
     
     try:
-        realtime_df = ak.stock_zh_a_spot_em()
+        realtime_df = get_spot_snapshot(from_tool=True)
         filtered_df = realtime_df[~realtime_df['代码'].str.startswith('688')]
         filtered_df = filtered_df[~filtered_df['名称'].str.contains('退')]
         filtered_df = filtered_df[~filtered_df['名称'].str.contains('ST')]
@@ -73,26 +76,14 @@ def get_valid_stock_data(stock_codes):
         filtered_df = filtered_df[filtered_df['总市值'] >= 10000*10000*100]
 
 
-        if stock_codes is None:
-            stock_codes = filtered_df['代码'].tolist()
-        for code in stock_codes:
-            stock_data = filtered_df[filtered_df['代码'] == code]
-            
-            if len(stock_data) == 0:
-                continue
-                
-            row = stock_data.iloc[0]
-            current_price = row['最新价']
-            
-            # 检查数据是否有效
-            if pd.isna(current_price) or current_price == 0:
-                continue
-            stock_dict = row.to_dict()
-            for _, value in stock_dict.items():
-                if pd.isna(value):
-                    stock_dict = None
-            if stock_dict:
-                result["stocks"][code] = stock_dict
+        # 检查数据是否有效：价格非零且所有字段都不为空
+        valid_df = filtered_df[filtered_df['最新价'].notna() & (filtered_df['最新价'] != 0)]
+        valid_df = valid_df[valid_df.notna().all(axis=1)]
+        valid_df = valid_df.drop_duplicates('代码').set_index('代码', drop=False)
+
+        if stock_codes is not None:
+            valid_df = valid_df.reindex([code for code in stock_codes if code in valid_df.index])
+        result["stocks"] = valid_df.to_dict('index')
 
     except Exception as e:
         result["error"] = str(e)
@@ -133,7 +124,7 @@ def analyze_stock_trend_detailed(stock_identifier: str, period="30d"):
         # 如果输入包含中文，认为是股票名称
         if any('\u4e00' <= char <= '\u9fff' for char in stock_identifier):
             # 先查询股票代码
-            realtime_df = ak.stock_zh_a_spot_em()
+            realtime_df = get_spot_snapshot(from_tool=True)
             matched = realtime_df[realtime_df['名称'].str.contains(stock_identifier, na=False)]
             
             if len(matched) == 0:
@@ -156,12 +147,7 @@ def analyze_stock_trend_detailed(stock_identifier: str, period="30d"):
             stock_name = matched.iloc[0]['名称']
         
         # 1. 获取数据
-        df = ak.stock_zh_a_hist(
-            symbol=stock_code, period="daily", 
-            start_date=(datetime.now() - timedelta(days=60)).strftime('%Y%m%d'),
-            end_date=datetime.now().strftime('%Y%m%d'),
-            adjust="qfq"
-        )
+        df = get_daily_history(stock_code, days=60, adjust="qfq", from_tool=True).copy()
         
         # 计算核心指标
         df['MA5'] = df['收盘'].rolling(window=5).mean()
@@ -177,8 +163,8 @@ def analyze_stock_trend_detailed(stock_identifier: str, period="30d"):
             "close": round(x['收盘'], 2),
             "vol_change": f"{round((x['成交量']/x['VOL_MA5'] - 1) * 100, 1)}%" # 成交量对比均量
         }, axis=1).tolist()
+        last_row = analysis_df.iloc[-1]
 
-            
         # 4. 构建返回结构
         return {
             "metadata": {
@@ -201,17 +187,37 @@ def analyze_stock_trend_detailed(stock_identifier: str, period="30d"):
 INITIAL_CASH = 300000.0
 
 PORTFOLIO_FILE = "data/portfolio_state.json"
+# 非默认用户的账户文件目录（批量运行时每个模拟账户一个文件）
+PORTFOLIO_DIR = "data/portfolios"
+DEFAULT_USER_ID = "1"
+
+# 各用户的虚拟账户状态，按 user_id 缓存
+_portfolio_states = {}
+_portfolio_lock = threading.RLock()
+
+
+def _safe_user_id(user_id: str):
+    '''用于文件名的 user_id：只保留字母、数字、下划线和连字符'''
+    return re.sub(r"[^\w-]", "_", str(user_id)) or "_"
+
+
+def _portfolio_file(user_id: str):
+    if user_id == DEFAULT_USER_ID:
+        return PORTFOLIO_FILE
+    return os.path.join(PORTFOLIO_DIR, f"portfolio_state_{_safe_user_id(user_id)}.json")
 
-# 全局虚拟账户状态（单用户场景）
 
-def _load_portfolio_state():
+def _load_portfolio_state(user_id: str = DEFAULT_USER_ID):
     try:
-        with open(PORTFOLIO_FILE, "r", encoding="utf-8") as f:
+        with open(_portfolio_file(user_id), "r", encoding="utf-8") as f:
             data = json.load(f)
         if not isinstance(data, dict):
             raise ValueError("invalid portfolio data")
         cash = float(data.get("cash", INITIAL_CASH))
-        positions = data.get("positions", {}) or {}
+        positions = {
+            code: Position.from_dict(code, pos)
+            for code, pos in (data.get("positions", {}) or {}).items()
+        }
         return {
             'cash': cash,
             'positions': positions,
@@ -223,35 +229,63 @@ def _load_portfolio_state():
         }
 
 
-def _save_portfolio_state():
+def _save_portfolio_state(user_id: str = DEFAULT_USER_ID):
     try:
-        with open(PORTFOLIO_FILE, "w", encoding="utf-8") as f:
-            json.dump(portfolio_state, f, ensure_ascii=False, indent=4)
+        path = _portfolio_file(user_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with _portfolio_lock:
+            state = _get_portfolio_state(user_id)
+            data = {
+                'cash': state['cash'],
+                'positions': {code: pos.to_dict() for code, pos in state['positions'].items()},
+            }
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
     except Exception:
         # 持久化失败时不影响交易逻辑
         pass
 
 
-portfolio_state = _load_portfolio_state()
+def _get_portfolio_state(user_id: str = DEFAULT_USER_ID):
+    '''获取指定用户的账户状态，首次访问时从文件加载'''
+    with _portfolio_lock:
+        state = _portfolio_states.get(user_id)
+        if state is None:
+            state = _load_portfolio_state(user_id)
+            _portfolio_states[user_id] = state
+        return state
 
 
-def _get_latest_price(stock_code: str):
-    '''获取单只股票的最新价格，失败时返回None'''
+def _runtime_user_id(runtime: ToolRuntime | None):
+    '''从工具运行时上下文中取出 user_id，缺省为默认用户'''
+    context = getattr(runtime, 'context', None) if runtime is not None else None
+    user_id = getattr(context, 'user_id', None)
+    return str(user_id) if user_id else DEFAULT_USER_ID
+
+
+# 默认用户的虚拟账户状态（单用户场景，保持兼容）
+portfolio_state = _get_portfolio_state(DEFAULT_USER_ID)
+
+
+def _get_latest_prices(stock_codes, from_tool=True):
+    '''一次行情请求批量获取多只股票的最新价格，返回 {代码: 价格}，无效价格不包含在结果中'''
     try:
-        realtime_df = ak.stock_zh_a_spot_em()
-        row = realtime_df[realtime_df['代码'] == stock_code]
-        if len(row) == 0:
-            return None
-        price = row.iloc[0]['最新价']
-        if pd.isna(price) or price == 0:
-            return None
-        return float(price)
+        realtime_df = get_spot_snapshot(from_tool=from_tool)
+        prices = pd.to_numeric(realtime_df.set_index('代码')['最新价'], errors='coerce')
+        prices = prices[~prices.index.duplicated()].reindex(list(stock_codes))
+        prices = prices[prices.notna() & (prices != 0)]
+        return {code: float(price) for code, price in prices.items()}
     except Exception:
-        return None
+        return {}
+
+
+def _get_latest_price(stock_code: str):
+    '''获取单只股票的最新价格，失败时返回None'''
+    return _get_latest_prices([stock_code]).get(stock_code)
 
 
 @tool
-def buy_stock(stock_code: str, stock_name: str, hands: int, stop_loss_pct: float | None = None, take_profit_pct: float | None = None):
+def buy_stock(stock_code: str, stock_name: str, hands: int, stop_loss_pct: float | None = None, take_profit_pct: float | None = None, runtime: ToolRuntime = None):
     '''
     虚拟买入股票（不连接真实券商），并为本次交易设定止损/止盈条件（可选）
 
@@ -265,7 +299,8 @@ def buy_stock(stock_code: str, stock_name: str, hands: int, stop_loss_pct: float
     返回:
         包含成交价格、数量、剩余现金和当前持仓及止损/止盈设置的字典
     '''
-    global portfolio_state
+    user_id = _runtime_user_id(runtime)
+    portfolio_state = _get_portfolio_state(user_id)
 
     if hands <= 0:
         return {'error': '买入手数必须大于0'}
@@ -277,54 +312,40 @@ def buy_stock(stock_code: str, stock_name: str, hands: int, stop_loss_pct: float
     shares = hands * 100
     cost = price * shares
 
-    if cost > portfolio_state['cash']:
-        return {
-            'error': '可用现金不足，无法完成买入',
-            'cash': round(portfolio_state['cash'], 2),
-            'required': round(cost, 2),
-        }
+    # 检查现金到保存完成都持有锁，同一账户的并发交易不会超额买入
+    with _portfolio_lock:
+        if cost > portfolio_state['cash']:
+            return {
+                'error': '可用现金不足，无法完成买入',
+                'cash': round(portfolio_state['cash'], 2),
+                'required': round(cost, 2),
+            }
 
-    # 更新现金
-    portfolio_state['cash'] -= cost
-
-    # 更新持仓
-    position = portfolio_state['positions'].get(
-        stock_code,
-        {
-            'name': '',
-            'shares': 0,
-            'avg_cost': 0.0,
-            'stop_loss_pct': None,
-            'take_profit_pct': None,
-        },
-    )
-    total_shares = position['shares'] + shares
-    if total_shares > 0:
-        new_avg_cost = (
-            position['avg_cost'] * position['shares'] + cost
-        ) / total_shares
-    else:
-        new_avg_cost = price
-
-    position['name'] = stock_name
-    position['shares'] = total_shares
-    position['avg_cost'] = new_avg_cost
-    # 若本次传入止损/止盈参数，则更新持仓中的设置
-    if stop_loss_pct is not None:
-        position['stop_loss_pct'] = stop_loss_pct
-    if take_profit_pct is not None:
-        position['take_profit_pct'] = take_profit_pct
-    portfolio_state['positions'][stock_code] = position
-    _save_portfolio_state()
-
-    sl_pct = position.get('stop_loss_pct')
-    tp_pct = position.get('take_profit_pct')
-    stop_loss_price = None
-    take_profit_price = None
-    if sl_pct is not None:
-        stop_loss_price = round(position['avg_cost'] * (1 - sl_pct / 100), 2)
-    if tp_pct is not None:
-        take_profit_price = round(position['avg_cost'] * (1 + tp_pct / 100), 2)
+        # 更新现金
+        portfolio_state['cash'] -= cost
+
+        # 更新持仓
+        position = portfolio_state['positions'].get(stock_code) or Position(code=stock_code)
+        total_shares = position.shares + shares
+        if total_shares > 0:
+            new_avg_cost = (
+                position.avg_cost * position.shares + cost
+            ) / total_shares
+        else:
+            new_avg_cost = price
+
+        position.name = stock_name
+        position.shares = total_shares
+        position.avg_cost = new_avg_cost
+        # 若本次传入止损/止盈参数，则更新持仓中的设置
+        if stop_loss_pct is not None:
+            position.stop_loss_pct = stop_loss_pct
+        if take_profit_pct is not None:
+            position.take_profit_pct = take_profit_pct
+        portfolio_state['positions'][stock_code] = position
+        _save_portfolio_state(user_id)
+        cash_after = portfolio_state['cash']
+        trade_time = trading_calendar.now().strftime('%Y-%m-%d %H:%M:%S')
 
     return {
         'action': 'buy',
@@ -333,20 +354,21 @@ def buy_stock(stock_code: str, stock_name: str, hands: int, stop_loss_pct: float
         'hands': hands,
         'shares': shares,
         'cost': round(cost, 2),
-        'cash_after': round(portfolio_state['cash'], 2),
+        'cash_after': round(cash_after, 2),
+        'time': trade_time,
         'position': {
-            'shares': position['shares'],
-            'avg_cost': round(position['avg_cost'], 2),
-            'stop_loss_pct': sl_pct,
-            'take_profit_pct': tp_pct,
-            'stop_loss_price': stop_loss_price,
-            'take_profit_price': take_profit_price,
+            'shares': position.shares,
+            'avg_cost': round(position.avg_cost, 2),
+            'stop_loss_pct': position.stop_loss_pct,
+            'take_profit_pct': position.take_profit_pct,
+            'stop_loss_price': position.stop_loss_price,
+            'take_profit_price': position.take_profit_price,
         },
     }
 
 
 @tool
-def sell_stock(stock_code: str, hands: int):
+def sell_stock(stock_code: str, hands: int, runtime: ToolRuntime = None):
     '''
     虚拟卖出股票（不连接真实券商）
 
@@ -357,41 +379,50 @@ def sell_stock(stock_code: str, hands: int):
     返回:
         包含成交价格、数量、剩余现金和本次盈亏的字典
     '''
-    global portfolio_state
+    user_id = _runtime_user_id(runtime)
+    portfolio_state = _get_portfolio_state(user_id)
 
     if hands <= 0:
         return {'error': '卖出手数必须大于0'}
 
-    position = portfolio_state['positions'].get(stock_code)
-    if not position or position['shares'] <= 0:
+    if stock_code not in portfolio_state['positions']:
         return {'error': f'当前没有持有股票 {stock_code}，无法卖出'}
 
-    shares = hands * 100
-    if shares > position['shares']:
-        return {
-            'error': '卖出数量超过当前持仓',
-            'holding_shares': position['shares'],
-            'requested_shares': shares,
-        }
-
     price = _get_latest_price(stock_code)
     if price is None:
         return {'error': f'无法获取股票 {stock_code} 的最新价格'}
 
-    proceeds = price * shares
-    portfolio_state['cash'] += proceeds
+    shares = hands * 100
+    # 检查持仓到保存完成都持有锁，同一账户的并发交易不会超额卖出
+    with _portfolio_lock:
+        position = portfolio_state['positions'].get(stock_code)
+        if not position or position.shares <= 0:
+            return {'error': f'当前没有持有股票 {stock_code}，无法卖出'}
+
+        if shares > position.shares:
+            return {
+                'error': '卖出数量超过当前持仓',
+                'holding_shares': position.shares,
+                'requested_shares': shares,
+            }
 
-    # 计算本次实现盈亏
-    avg_cost = position['avg_cost']
-    realized_profit = (price - avg_cost) * shares
+        proceeds = price * shares
+        portfolio_state['cash'] += proceeds
 
-    # 更新持仓数量
-    position['shares'] -= shares
-    if position['shares'] == 0:
-        portfolio_state['positions'].pop(stock_code, None)
-    else:
-        portfolio_state['positions'][stock_code] = position
-    _save_portfolio_state()
+        # 计算本次实现盈亏
+        avg_cost = position.avg_cost
+        realized_profit = (price - avg_cost) * shares
+
+        # 更新持仓数量
+        position.shares -= shares
+        if position.shares == 0:
+            portfolio_state['positions'].pop(stock_code, None)
+        else:
+            portfolio_state['positions'][stock_code] = position
+        _save_portfolio_state(user_id)
+        cash_after = portfolio_state['cash']
+        remaining_shares = position.shares
+        trade_time = trading_calendar.now().strftime('%Y-%m-%d %H:%M:%S')
 
     return {
         'action': 'sell',
@@ -400,63 +431,56 @@ def sell_stock(stock_code: str, hands: int):
         'hands': hands,
         'shares': shares,
         'proceeds': round(proceeds, 2),
-        'cash_after': round(portfolio_state['cash'], 2),
+        'cash_after': round(cash_after, 2),
         'realized_profit': round(realized_profit, 2),
-        'remaining_shares': position['shares'],
+        'remaining_shares': remaining_shares,
+        'time': trade_time,
     }
 
 
 @tool
-def get_portfolio():
+def get_portfolio(runtime: ToolRuntime = None):
     '''
     获取当前虚拟账户持仓和现金情况
 
     返回:
         包含现金、持仓列表和估算总资产的字典
     '''
-    global portfolio_state
+    user_id = _runtime_user_id(runtime)
+    portfolio_state = _get_portfolio_state(user_id)
 
     result = {
         'cash': round(portfolio_state['cash'], 2),
         'positions': [],
     }
 
-    # 尝试获取行情估算市值
-    try:
-        realtime_df = ak.stock_zh_a_spot_em()
-    except Exception:
-        realtime_df = None
-
-    total_assets = portfolio_state['cash']
+    # 一次请求获取所有持仓的行情，按数组形式批量估值
+    positions = positions_to_array(portfolio_state['positions'])
+    prices = _get_latest_prices(positions['code'])
+    market_prices, market_values, _ = value_positions(positions, prices)
 
-    for code, pos in portfolio_state['positions'].items():
-        market_price = None
-        market_value = None
+    total_assets = portfolio_state['cash'] + np.nansum(market_values)
 
-        if realtime_df is not None:
-            row = realtime_df[realtime_df['代码'] == code]
-            if len(row) > 0:
-                price = row.iloc[0]['最新价']
-                if not pd.isna(price) and price != 0:
-                    market_price = float(price)
-                    market_value = market_price * pos['shares']
-                    total_assets += market_value
+    for i, pos in enumerate(positions):
+        market_price = market_prices[i]
+        market_value = market_values[i]
+        has_price = not np.isnan(market_price)
 
         result['positions'].append(
             {
-                'stock_code': code,
-                'shares': pos['shares'],
-                'avg_cost': round(pos['avg_cost'], 2),
-                'market_price': round(market_price, 2)
-                if market_price is not None
+                'stock_code': str(pos['code']),
+                'shares': int(pos['shares']),
+                'avg_cost': round(float(pos['avg_cost']), 2),
+                'market_price': round(float(market_price), 2)
+                if has_price
                 else None,
-                'market_value': round(market_value, 2)
-                if market_value is not None
+                'market_value': round(float(market_value), 2)
+                if has_price
                 else None,
             }
         )
 
-    result['total_assets_estimated'] = round(total_assets, 2)
+    result['total_assets_estimated'] = round(float(total_assets), 2)
     return result
 
 
@@ -0,0 +1,141 @@
+"""
+A股交易日历 - 交易日、交易时段（含午休）和数据时效判断
+
+所有时间均按北京时间（不带时区的 datetime）处理。交易日列表来自新浪历史交易日接口，
+缓存到 data/trade_dates.json；接口不可用时退化为“周一到周五”。
+"""
+import json
+import threading
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+import akshare as ak
+
+
+TZ = ZoneInfo("Asia/Shanghai")
+# 连续竞价时段（上午、下午），中间为午休
+SESSIONS = [(time(9, 30), time(11, 30)), (time(13, 0), time(15, 0))]
+TRADE_DATES_FILE = "data/trade_dates.json"
+# 交易日列表的刷新间隔（天）
+TRADE_DATES_REFRESH_DAYS = 7
+# 接口失败后的重试间隔（秒），期间按工作日处理
+TRADE_DATES_RETRY_SECONDS = 600
+
+_trade_dates = None  # {'updated': 日期, 'dates': set, 'last': 列表中最后一个日期}
+_last_failure = None
+_calendar_lock = threading.Lock()
+
+
+def now():
+    '''当前北京时间'''
+    return datetime.now(TZ).replace(tzinfo=None)
+
+
+def _load_trade_dates():
+    global _trade_dates, _last_failure
+    current = now()
+    today = current.date()
+    with _calendar_lock:
+        if _trade_dates and (today - _trade_dates['updated']).days < TRADE_DATES_REFRESH_DAYS:
+            return _trade_dates
+        if _last_failure and (current - _last_failure).total_seconds() < TRADE_DATES_RETRY_SECONDS:
+            return _trade_dates
+
+        dates = None
+        updated = None
+        try:
+            with open(TRADE_DATES_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            updated = date.fromisoformat(data["updated"])
+            if (today - updated).days < TRADE_DATES_REFRESH_DAYS:
+                dates = data["dates"]
+        except Exception:
+            dates = None
+
+        if dates is None:
+            try:
+                df = ak.tool_trade_date_hist_sina()
+                dates = sorted(str(d)[:10] for d in df['trade_date'])
+                updated = today
+                with open(TRADE_DATES_FILE, "w", encoding="utf-8") as f:
+                    json.dump({"updated": today.isoformat(), "dates": dates}, f)
+            except Exception as e:
+                print(f"获取交易日历失败，按工作日处理: {e}", flush=True)
+                # 稍后重试；已有的（过期）交易日列表继续使用
+                _last_failure = current
+                return _trade_dates
+
+        _trade_dates = {
+            'updated': updated,
+            'dates': {date.fromisoformat(d) for d in dates},
+            'last': date.fromisoformat(dates[-1]) if dates else None,
+        }
+        return _trade_dates
+
+
+def is_trading_day(day=None):
+    '''是否为交易日（超出交易日列表范围时按工作日判断）'''
+    day = day or now().date()
+    if isinstance(day, datetime):
+        day = day.date()
+    calendar = _load_trade_dates()
+    if calendar and calendar['last'] and day <= calendar['last']:
+        return day in calendar['dates']
+    return day.weekday() < 5
+
+
+def is_market_open(dt=None):
+    '''是否处于连续竞价时段（午休和收盘后返回 False）'''
+    dt = dt or now()
+    if not is_trading_day(dt.date()):
+        return False
+    t = dt.time()
+    return any(start <= t < end for start, end in SESSIONS)
+
+
+def next_open(dt=None):
+    '''dt 之后最近一次开盘（包括午休后的下午开盘）'''
+    dt = dt or now()
+    day = dt.date()
+    for offset in range(0, 60):
+        d = day + timedelta(days=offset)
+        if not is_trading_day(d):
+            continue
+        for start, _ in SESSIONS:
+            candidate = datetime.combine(d, start)
+            if candidate > dt:
+                return candidate
+    raise ValueError(f"{day} 之后60天内没有交易日")
+
+
+def previous_trading_day(day=None):
+    day = day or now().date()
+    for offset in range(1, 60):
+        d = day - timedelta(days=offset)
+        if is_trading_day(d):
+            return d
+    raise ValueError(f"{day} 之前60天内没有交易日")
+
+
+def last_session_date(dt=None):
+    '''最近一个已开盘的交易日：今天开盘后为今天，否则为上一个交易日'''
+    dt = dt or now()
+    if is_trading_day(dt.date()) and dt.time() >= SESSIONS[0][0]:
+        return dt.date()
+    return previous_trading_day(dt.date())
+
+
+def is_fresh(fetched_at, ttl, at=None):
+    '''
+    数据是否仍然有效：
+    - 盘中获取的数据在 ttl 秒内有效
+    - 休市期间（夜间、周末、节假日、午休）获取的数据在下一次开盘前一直有效
+    '''
+    at = at or now()
+    if is_market_open(fetched_at):
+        return (at - fetched_at).total_seconds() < ttl
+    return at < next_open(fetched_at)
+
+
+def seconds_until(dt):
+    return max(0.0, (dt - now()).total_seconds())
@@ -0,0 +1,294 @@
+"""
+自选股监控 - 保存上一次行情快照，向量化比较新快照，只输出变化行和阈值穿越事件
+
+一次刷新只读取一次全市场快照（经 market_cache 缓存）并做一次 diff，Agent 通过 poll_watchlist_events 轮询事件，
+Gradio 界面通过 format_events_markdown 展示。定时刷新只有一个驱动方：调度器（scheduler）运行时由它在盘中调用
+refresh，否则由监控器自己的后台线程刷新。
+"""
+import threading
+import heapq
+from collections import deque
+
+import pandas as pd
+from langchain.tools import tool
+
+from stock.market_cache import get_spot_snapshot
+from stock import trading_calendar
+from stock.trading_calendar import is_market_open, next_open, seconds_until
+
+
+# 参与比较的字段
+WATCH_COLUMNS = ['最新价', '涨跌幅', '量比', '换手率']
+
+# 全局阈值：任一自选股穿越这些水平即产生事件（价格阈值按股票单独设置）
+DEFAULT_THRESHOLDS = {
+    '涨跌幅': [-9.9, -5.0, 5.0, 9.9],
+    '量比': [2.0, 5.0],
+    '换手率': [10.0, 20.0],
+}
+
+# 普通变化事件和阈值穿越事件分开保存，避免大量变化事件把未读的提醒挤出缓冲区
+MAX_EVENTS = 2000
+MAX_ALERTS = 2000
+
+
+class WatchlistMonitor:
+    '''自选股快照监控器'''
+
+    def __init__(self, thresholds=None, max_events=MAX_EVENTS, max_alerts=MAX_ALERTS):
+        self.codes = set()
+        self.price_levels = {}  # code -> [价格水平]
+        self.thresholds = thresholds or DEFAULT_THRESHOLDS
+        self.events = deque(maxlen=max_events)  # 普通变化
+        self.alerts = deque(maxlen=max_alerts)  # 阈值穿越
+        self.last_update = None
+        self._prev = None  # 上一次快照，index 为股票代码
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._external_driver = False
+
+    # ---- 自选股管理 ----
+    def add(self, codes, price_levels=None):
+        with self._lock:
+            self.codes.update(str(c) for c in codes)
+            for code, levels in (price_levels or {}).items():
+                self.price_levels.setdefault(str(code), [])
+                self.price_levels[str(code)] = sorted(set(self.price_levels[str(code)]) | {float(x) for x in levels})
+
+    def remove(self, codes):
+        with self._lock:
+            for code in codes:
+                self.codes.discard(str(code))
+                self.price_levels.pop(str(code), None)
+                if self._prev is not None and str(code) in self._prev.index:
+                    self._prev = self._prev.drop(index=str(code))
+
+    def watch(self, codes, price_levels=None):
+        '''加入监控；首次加入时立即建立基准快照，之后的刷新由调度器或后台线程负责'''
+        self.add(codes, price_levels)
+        if self.last_update is None:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"自选股基准快照失败: {e}", flush=True)
+        self.start()
+
+    # ---- 快照比较 ----
+    def refresh(self, spot_df=None):
+        '''读取一次行情快照（或使用传入的快照），与上一次快照比较，返回新产生的事件列表'''
+        if spot_df is None:
+            spot_df = get_spot_snapshot()
+
+        with self._lock:
+            if not self.codes:
+                return []
+            snapshot = spot_df[spot_df['代码'].isin(self.codes)]
+            snapshot = snapshot.set_index('代码')[['名称'] + WATCH_COLUMNS]
+            snapshot[WATCH_COLUMNS] = snapshot[WATCH_COLUMNS].apply(pd.to_numeric, errors='coerce')
+
+            now = trading_calendar.now().strftime('%Y-%m-%d %H:%M:%S')
+            new_events = []
+            prev = self._prev
+            if prev is not None:
+                common = snapshot.index.intersection(prev.index)
+                cur = snapshot.loc[common, WATCH_COLUMNS]
+                old = prev.loc[common, WATCH_COLUMNS]
+                names = snapshot.loc[common, '名称']
+
+                # 1. 变化行：任一字段变化
+                changed_mask = (cur.ne(old) & ~(cur.isna() & old.isna())).any(axis=1)
+                if changed_mask.any():
+                    diff = (cur[changed_mask] - old[changed_mask]).round(4)
+                    for code, row in cur[changed_mask].iterrows():
+                        new_events.append({
+                            'type': 'change',
+                            'code': code,
+                            'name': names[code],
+                            'values': {k: _clean(v) for k, v in row.items()},
+                            'delta': {k: _clean(v) for k, v in diff.loc[code].items()},
+                        })
+
+                # 2. 全局阈值穿越
+                for metric, levels in self.thresholds.items():
+                    for level in levels:
+                        new_events.extend(self._crossings(old[metric], cur[metric], level, metric, names))
+
+                # 3. 单股价格阈值穿越
+                if self.price_levels:
+                    levels_df = pd.DataFrame(
+                        [(code, lv) for code, lvs in self.price_levels.items() for lv in lvs if code in common],
+                        columns=['代码', 'level'],
+                    )
+                    if len(levels_df) > 0:
+                        prev_px = old['最新价'].reindex(levels_df['代码']).to_numpy()
+                        cur_px = cur['最新价'].reindex(levels_df['代码']).to_numpy()
+                        lv = levels_df['level'].to_numpy()
+                        up = (prev_px < lv) & (cur_px >= lv)
+                        down = (prev_px > lv) & (cur_px <= lv)
+                        for i in (up | down).nonzero()[0]:
+                            code = levels_df['代码'].iat[i]
+                            new_events.append({
+                                'type': 'cross_up' if up[i] else 'cross_down',
+                                'code': code,
+                                'name': names[code],
+                                'metric': '最新价',
+                                'level': float(lv[i]),
+                                'prev': _clean(prev_px[i]),
+                                'value': _clean(cur_px[i]),
+                            })
+
+            for event in new_events:
+                event['id'] = self._next_id
+                event['time'] = now
+                self._next_id += 1
+                (self.events if event['type'] == 'change' else self.alerts).append(event)
+
+            self._prev = snapshot
+            self.last_update = now
+            return new_events
+
+    @staticmethod
+    def _crossings(old, cur, level, metric, names):
+        up = (old < level) & (cur >= level)
+        down = (old > level) & (cur <= level)
+        events = []
+        for code in old.index[up | down]:
+            events.append({
+                'type': 'cross_up' if up[code] else 'cross_down',
+                'code': code,
+                'name': names[code],
+                'metric': metric,
+                'level': level,
+                'prev': _clean(old[code]),
+                'value': _clean(cur[code]),
+            })
+        return events
+
+    def poll(self, since_id=0, only_alerts=False, limit=100):
+        '''
+        按时间顺序返回 id 大于 since_id 的最早 limit 条事件，以及是否还有未返回的事件
+
+        调用方用返回的最后一条事件 id 作为下一次的 since_id，即可不遗漏地逐页读取。
+        '''
+        with self._lock:
+            if only_alerts:
+                events = [e for e in self.alerts if e['id'] > since_id]
+            else:
+                events = list(heapq.merge(
+                    (e for e in self.events if e['id'] > since_id),
+                    (e for e in self.alerts if e['id'] > since_id),
+                    key=lambda e: e['id'],
+                ))
+        return events[:limit], len(events) > limit
+
+    def recent(self, limit=50):
+        '''最新的 limit 条事件（供界面展示）'''
+        with self._lock:
+            events = list(heapq.merge(self.events, self.alerts, key=lambda e: e['id']))
+        return events[-limit:]
+
+    # ---- 后台定时刷新 ----
+    def use_external_driver(self):
+        '''改由外部（调度器）驱动刷新，停止并不再启动自己的后台线程'''
+        self._external_driver = True
+        self.stop()
+
+    def start(self, interval=30):
+        if self._external_driver or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+
+        def _loop():
+            while not self._stop.is_set():
+                # 休市期间行情不变，只在首次（建立基准快照）和盘中刷新
+                if self.last_update is None or is_market_open():
+                    try:
+                        self.refresh()
+                    except Exception as e:
+                        print(f"自选股刷新失败: {e}", flush=True)
+                    self._stop.wait(interval)
+                else:
+                    self._stop.wait(min(seconds_until(next_open()), 600))
+
+        self._thread = threading.Thread(target=_loop, name="watchlist-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def _clean(value):
+    if pd.isna(value):
+        return None
+    return round(float(value), 4)
+
+
+# 全局监控器（单用户场景）
+watchlist_monitor = WatchlistMonitor()
+
+
+def format_events_markdown(events):
+    '''把事件渲染成 Markdown 表格，供 Gradio 面板显示'''
+    if not events:
+        return "暂无自选股异动"
+    lines = ["| 时间 | 股票 | 事件 | 详情 |", "| --- | --- | --- | --- |"]
+    for e in reversed(events):
+        if e['type'] == 'change':
+            detail = "，".join(f"{k} {v}({e['delta'][k]:+})" for k, v in e['values'].items()
+                              if v is not None and e['delta'].get(k))
+            label = "变化"
+        else:
+            label = "⬆️ 上穿" if e['type'] == 'cross_up' else "⬇️ 下穿"
+            detail = f"{e['metric']} {e['prev']} → {e['value']}（阈值 {e['level']}）"
+        lines.append(f"| {e['time'][11:]} | {e['name']}({e['code']}) | {label} | {detail} |")
+    return "\n".join(lines)
+
+
+@tool
+def add_to_watchlist(stock_codes: list[str], price_levels: dict[str, list[float]] | None = None):
+    '''
+    把股票加入自选股监控列表，可选地为个股设置价格提醒水平
+
+    参数:
+        stock_codes: 股票代码列表，例如 ["000001", "600519"]
+        price_levels: 个股价格提醒，例如 {"600519": [1500, 1600]}，价格上穿或下穿时产生事件
+
+    返回:
+        当前监控的股票数量
+    '''
+    watchlist_monitor.watch(stock_codes, price_levels)
+    return {
+        'watching': sorted(watchlist_monitor.codes),
+        'count': len(watchlist_monitor.codes),
+    }
+
+
+@tool
+def poll_watchlist_events(since_id: int = 0, only_alerts: bool = True):
+    '''
+    轮询自选股异动事件（不会重新下载行情，只读取最近一次比较的结果）
+
+    参数:
+        since_id: 只返回 id 大于该值的事件，首次调用传 0
+        only_alerts: 为 True 时只返回阈值穿越事件（涨跌幅、量比、换手率、价格提醒），忽略普通变化
+
+    返回:
+        按时间顺序的事件列表（每次最多100条）、本次最后一条事件 id，以及 has_more（为 True 时用 last_event_id 继续轮询）
+    '''
+    if not watchlist_monitor.codes:
+        return {'error': '自选股列表为空，请先调用 add_to_watchlist'}
+    events, has_more = watchlist_monitor.poll(since_id=since_id, only_alerts=only_alerts)
+    return {
+        'last_update': watchlist_monitor.last_update,
+        'last_event_id': events[-1]['id'] if events else since_id,
+        'has_more': has_more,
+        'events': events,
+    }
+
+
+watchlist_tools = [
+    add_to_watchlist,
+    poll_watchlist_events,
+]
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+ak = pytest.importorskip("akshare")
+pytest.importorskip("langchain")
+
+
+def make_spot(codes, price=10.0):
+    """构造最小的全市场快照（get_spot_snapshot 的列）"""
+    n = len(codes)
+    return pd.DataFrame({
+        '代码': codes,
+        '名称': [f"股票{c}" for c in codes],
+        '最新价': np.full(n, price),
+        '成交量': np.full(n, 1000.0),
+        '涨跌幅': np.zeros(n),
+        '量比': np.ones(n),
+        '换手率': np.ones(n),
+        '总市值': np.full(n, 1e10),
+    })
+
+
+def make_hist(dates, start=5.0, end=10.0):
+    """构造 ak.stock_zh_a_hist 格式的日线"""
+    return pd.DataFrame({
+        '日期': list(dates),
+        '收盘': np.linspace(start, end, len(dates)),
+        '成交量': 1000.0,
+        '换手率': 1.0,
+    })
+
+
+@pytest.fixture(autouse=True)
+def offline_calendar(tmp_path, monkeypatch):
+    """交易日历不联网：按工作日，缓存文件写到临时目录"""
+    from stock import trading_calendar
+
+    def _trade_dates():
+        return pd.DataFrame({'trade_date': pd.bdate_range('2025-01-01', '2027-12-31').date})
+
+    monkeypatch.setattr(ak, "tool_trade_date_hist_sina", _trade_dates, raising=False)
+    monkeypatch.setattr(trading_calendar, "TRADE_DATES_FILE", str(tmp_path / "trade_dates.json"))
+    monkeypatch.setattr(trading_calendar, "_trade_dates", None)
+    monkeypatch.setattr(trading_calendar, "_last_failure", None)
+
+
+@pytest.fixture
+def matrix(tmp_path, monkeypatch):
+    """临时目录中的空价格矩阵，并设为全局矩阵"""
+    from stock import price_matrix
+
+    m = price_matrix.PriceMatrix(directory=str(tmp_path / "price_matrix"))
+    monkeypatch.setattr(price_matrix, "_matrix", m)
+    return m
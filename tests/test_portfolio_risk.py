@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+from conftest import ak, make_hist, make_spot
+from stock import portfolio_risk
+
+
+def test_position_risk_with_new_holding(matrix, monkeypatch):
+    # 之前的调用已经建好矩阵，新买入的股票不在矩阵中
+    matrix.update_from_spot(make_spot(['600519'], 1500.0), '2026-10-16')
+    dates = pd.bdate_range('2026-06-01', '2026-10-16').strftime('%Y-%m-%d')
+    calls = []
+
+    def fake_hist(symbol, **kwargs):
+        calls.append(symbol)
+        return make_hist(dates, 10.0, 12.0 if symbol == '002891' else 20.0)
+
+    monkeypatch.setattr(ak, "stock_zh_a_hist", fake_hist, raising=False)
+    monkeypatch.setattr(portfolio_risk, "_backfill_attempts", {})
+
+    result = portfolio_risk.position_risk(['002891', '600519'], np.array([100, 100]), 10000.0, window=20)
+
+    assert '002891' in matrix.codes
+    assert result['window'] == 20
+    assert [p['stock_code'] for p in result['positions']] == ['002891', '600519']
+    assert np.isfinite(result['portfolio_return_pct'])
+
+    # 同一交易日内不再重复下载
+    portfolio_risk.position_risk(['002891', '600519'], np.array([100, 100]), 10000.0, window=300)
+    assert sorted(calls) == ['002891', '600519']
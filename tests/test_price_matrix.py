@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+from conftest import ak, make_hist, make_spot
+from stock.price_matrix import PriceMatrix
+
+
+def test_new_listing_grows_existing_matrix(matrix):
+    matrix.update_from_spot(make_spot(['000001', '000002'], 10.0), '2026-10-15')
+    matrix.update_from_spot(make_spot(['000001', '000002', '000003'], 11.0), '2026-10-16')
+
+    assert matrix.codes == ['000001', '000002', '000003']
+    assert matrix.arrays['close'].shape[0] == 3
+    close = matrix.history('close', ['000001', '000003'], 2)
+    np.testing.assert_allclose(close[0], [10.0, 11.0])
+    assert np.isnan(close[1, 0]) and close[1, 1] == 11.0
+
+    # 扩容后继续写入不受影响
+    matrix.update_from_spot(make_spot(['000001', '000002', '000003'], 12.0), '2026-10-19')
+    assert matrix.history('close', ['000003'], 1)[0, 0] == 12.0
+
+
+def test_backfill_unseen_code_grows_matrix(matrix, monkeypatch):
+    matrix.update_from_spot(make_spot(['000001', '000002'], 10.0), '2026-10-16')
+    dates = pd.bdate_range('2026-09-01', '2026-10-16').strftime('%Y-%m-%d')
+    monkeypatch.setattr(ak, "stock_zh_a_hist", lambda symbol, **kwargs: make_hist(dates), raising=False)
+
+    assert matrix.backfill(['600519']) == 1
+    assert matrix.codes[-1] == '600519'
+    assert np.isfinite(matrix.history('close', ['600519'], len(dates))).all()
+    # 原有股票当天的数据保留
+    assert matrix.history('close', ['000001'], 1)[0, 0] == 10.0
+
+
+def test_grown_matrix_reloads_from_disk(matrix):
+    matrix.update_from_spot(make_spot(['000001', '000002'], 10.0), '2026-10-15')
+    matrix.update_from_spot(make_spot(['000001', '000002', '000003'], 11.0), '2026-10-16')
+
+    reloaded = PriceMatrix(directory=matrix.directory)
+    assert reloaded.codes == matrix.codes
+    assert reloaded.arrays['close'].shape[0] == 3
+    assert reloaded.history('close', ['000003'], 1)[0, 0] == 11.0
+
+
+def test_rank_stocks_refreshes_today_intraday(matrix, monkeypatch):
+    from datetime import datetime
+
+    from stock import market_cache, price_matrix, trading_calendar
+
+    codes = [f"{i:06d}" for i in range(1, 11)]
+    for date in ['2026-10-13', '2026-10-14', '2026-10-15', '2026-10-16']:
+        matrix.update_from_spot(make_spot(codes, 10.0), date)
+
+    clock = [datetime(2026, 10, 19, 10, 0)]
+    price = [11.0]
+    downloads = []
+
+    def fake_spot():
+        downloads.append(clock[0])
+        return make_spot(codes, price[0])
+
+    monkeypatch.setattr(trading_calendar, "now", lambda: clock[0])
+    monkeypatch.setattr(ak, "stock_zh_a_spot_em", fake_spot, raising=False)
+    monkeypatch.setattr(market_cache, "spot_cache", market_cache.TTLCache("spot"))
+    monkeypatch.setattr(price_matrix, "_applied_spot", None)
+
+    result = price_matrix.rank_stocks.func(window=3)
+    assert result['as_of'] == '2026-10-19'
+    assert matrix.history('close', ['000001'], 1)[0, 0] == 11.0
+
+    # 快照有效期内复用同一份快照
+    price_matrix.rank_stocks.func(window=3)
+    assert len(downloads) == 1
+
+    # 快照过期后，当天的一列随新快照更新
+    clock[0] = datetime(2026, 10, 19, 10, 5)
+    price[0] = 12.0
+    price_matrix.rank_stocks.func(window=3)
+    assert len(downloads) == 2
+    assert matrix.dates[-1] == '2026-10-19' and len(matrix.dates) == 5
+    assert matrix.history('close', ['000001'], 1)[0, 0] == 12.0